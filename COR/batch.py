@@ -0,0 +1,225 @@
+import argparse
+import configparser
+import csv
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import main
+
+
+def parse_args (argv=None):
+    description = 'Correction of rotation axis for many tomographies, processed in parallel without any interaction'
+    parser = argparse.ArgumentParser(description=description)
+
+    #positional argument
+    parser.add_argument('configs', nargs='*', help='paths of the configuration files, one for each tomography')
+
+    #optional arguments
+    parser.add_argument('-scans',
+                         dest='scans',
+                         required=False,
+                         help='glob pattern of the directories of the tomographies (e.g. "beamtime/scan_*"), used with -template')
+    parser.add_argument('-template',
+                         dest='template',
+                         required=False,
+                         help='configuration file used for all the directories of -scans, where {scan} is replaced by the directory of each tomography')
+    parser.add_argument('-workers',
+                         dest='workers',
+                         type=int,
+                         default=1,
+                         required=False,
+                         help='maximum number of tomographies processed at the same time (processes)')
+    parser.add_argument('-summary',
+                         dest='summary',
+                         default='summary.csv',
+                         required=False,
+                         help='path of the .csv file with offset, tilt angle, residual and time of each tomography')
+    parser.add_argument('-roi',
+                         dest='roi',
+                         action= 'store_true',
+                         required=False,
+                         help='crop the images with the ROI of section [headless] of the configuration files')
+    parser.add_argument('-norm',
+                         dest='norm',
+                         action= 'store_true',
+                         required=False,
+                         help='normalization of all images in the stack')
+    parser.add_argument('-outliers',
+                         dest='out',
+                         action= 'store_true',
+                         required=False,
+                         help='outliers filter is applied to all images in the stack')
+    parser.add_argument('-estimate',
+                         dest='estimate',
+                         action= 'store_true',
+                         required=False,
+                         help='estimate just the axis of rotation, without correcting the images')
+    parser.add_argument('-stream',
+                         dest='stream',
+                         action= 'store_true',
+                         required=False,
+                         help='correct the images chunk by chunk without keeping the whole stack in memory')
+    parser.add_argument('-resume',
+                         dest='resume',
+                         action= 'store_true',
+                         required=False,
+                         help='keep the corrected images already saved and correct just the missing ones')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+def scan_configs (configs,scans=None,template=None):
+    '''
+    This function returns the configurations of all the tomographies to process:
+    the ones of the configuration files configs and the ones obtained from
+    the template, replacing {scan} with each directory matching the glob pattern scans.
+    The configuration files configs are read by process_scan(), so a missing or
+    wrong configuration file is reported as the failure of its tomography, like any
+    other error, without stopping the others.
+
+    Parameters
+    ----------
+    configs : list
+        list of strings representing the paths of the configuration files
+    scans : str, optional
+        glob pattern of the directories of the tomographies. Default is None
+    template : str, optional
+        path of the configuration file used for the directories of scans. Default is None
+
+    Returns
+    -------
+    scan_list : list
+        list of tuples (name,sections) for each tomography, where name identifies the
+        tomography and sections is a dictionary with the content of the configuration
+        (None for the configuration files configs, read by process_scan())
+
+    Raises
+    ------
+    ValueError
+        if scans is given without template or vice versa
+    OSError
+        if the template does not exist
+    ValueError
+        if there is no tomography to process
+    '''
+    if (scans is None) != (template is None):
+        raise ValueError('-scans and -template must be used together')
+
+    scan_list = [(config_file, None) for config_file in configs]
+
+    if scans is not None:
+        config = main.read_config(template)
+        for scan_dir in sorted(glob.glob(scans)):
+            if os.path.isdir(scan_dir):
+                sections = {s: {key: value.replace('{scan}', scan_dir) for key, value in config.items(s, raw=True)} for s in config.sections()}
+                scan_list.append((scan_dir, sections))
+
+    if len(scan_list) == 0:
+        raise ValueError('there is no tomography to process')
+    return scan_list
+
+
+def process_scan (name,sections,argv):
+    '''
+    This function runs the headless pipeline (see main.run()) on a single tomography,
+    in a process of the pool. The errors are not raised but reported in the results,
+    so a failed tomography does not stop the others.
+
+    Parameters
+    ----------
+    name : str
+        the name of the tomography (configuration file or directory)
+    sections : dict or None
+        the content of the configuration of the tomography (None to read the configuration file name)
+    argv : list
+        the optional arguments of the command line passed to main.parse_args()
+
+    Returns
+    -------
+    results : dict
+        the name of the tomography, the offset, the shift, the tilt angle and the residual of the
+        axis of rotation, the time spent (in seconds) and the status ('ok' or the error)
+    '''
+    main.use_headless_backend()     #no window can be opened in the processes of the pool
+
+    results = dict(scan=name, offset='', shift='', theta='', residual='', seconds='', status='ok')
+    start = time.perf_counter()
+    try:
+        if sections is None:
+            config = main.read_config(name)
+        else:
+            config = configparser.ConfigParser()
+            config.read_dict(sections)
+        args = main.parse_args([name, '-headless'] + argv)
+        results.update(main.run(args,config))
+    except Exception as e:
+        results['status'] = '{0}: {1}'.format(type(e).__name__, e)
+    results['seconds'] = round(time.perf_counter() - start, 3)
+    return results
+
+
+def write_summary (summary,results):
+    '''
+    This function writes a .csv file with a row for each tomography, containing the
+    offset, the shift used for the correction, the tilt angle, the residual, the time spent and the status.
+
+    Parameters
+    ----------
+    summary : str
+        path of the .csv file
+    results : list
+        list of the dictionaries returned by process_scan()
+    '''
+    with open(summary, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['scan','offset','shift','theta','residual','seconds','status'])
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def batch (argv=None):
+    '''
+    This function processes all the tomographies of the command line in a pool
+    of processes and writes the summary table.
+
+    Parameters
+    ----------
+    argv : list, optional
+        the arguments of the command line. Default is None (sys.argv is used)
+
+    Returns
+    -------
+    results : list
+        list of the dictionaries returned by process_scan(), in the order of the tomographies
+
+    Raises
+    ------
+    ValueError
+        if workers is lower than 1
+    '''
+    args = parse_args(argv)
+    if args.workers < 1:
+        raise ValueError('workers must be greater than zero')
+
+    scan_list = scan_configs(args.configs,args.scans,args.template)
+    flags = [flag for flag, value in (('-roi',args.roi),('-norm',args.norm),('-outliers',args.out),
+                                      ('-estimate',args.estimate),('-stream',args.stream),('-resume',args.resume)) if value]
+
+    print('> Processing {0} tomographies with {1} processes...'.format(len(scan_list), args.workers))
+    results = [None] * len(scan_list)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(process_scan,name,sections,flags): i for i, (name, sections) in enumerate(scan_list)}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            print('> {0}: {1}'.format(result['scan'], result['status']))
+
+    write_summary(args.summary,results)
+    print('> Summary saved in', args.summary)
+    return results
+
+
+
+if __name__ == '__main__':
+    batch()
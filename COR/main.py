@@ -3,12 +3,11 @@ import configparser
 import sys
 import os
 import preparation_data
-from show_stack import plot_tracker
 import preprocess_and_correction
-import user_interaction
+import record
 
 
-def parse_args ():
+def parse_args (argv=None):
     description = 'Correction of rotation axis for tomographic projections'
     parser = argparse.ArgumentParser(description=description)
 
@@ -31,119 +30,605 @@ def parse_args ():
                          action= 'store_true',
                          required=False,
                          help='outliers filter is applied to all images in the stack')
-    
-    args = parser.parse_args()
+    parser.add_argument('-estimate',
+                         dest='estimate',
+                         action= 'store_true',
+                         required=False,
+                         help='read just the projections at 0° and 180° and estimate the axis of rotation, without correcting the images')
+    parser.add_argument('-stream',
+                         dest='stream',
+                         action= 'store_true',
+                         required=False,
+                         help='estimate the axis of rotation on the projections at 0° and 180°, then correct the images chunk by chunk without keeping the whole stack in memory')
+    parser.add_argument('-headless',
+                         dest='headless',
+                         action= 'store_true',
+                         required=False,
+                         help='run without any window or question: ROI, rows for the axis estimation, type of outliers and the decision to correct the images are read from section [headless] of the configuration file')
+    parser.add_argument('-resume',
+                         dest='resume',
+                         action= 'store_true',
+                         required=False,
+                         help='resume a stopped run: the corrected images already saved (and verified) are kept and just the missing ones are corrected and saved')
+
+    args = parser.parse_args(argv)
     return args
 
-def main ():
 
-    args = parse_args()
+def parse_ROI (text):
+    '''
+    This function converts the coordinates of a ROI written in the configuration
+    file as "rowmin,rowmax,colmin,colmax" to a tuple of integers.
+
+    Parameters
+    ----------
+    text : str
+        the coordinates of the ROI separated by commas
+
+    Returns
+    -------
+    roi : tuple
+        coordinates (rowmin,rowmax,colmin,colmax) of the ROI
+
+    Raises
+    ------
+    ValueError
+        if text does not contain 4 integers separated by commas
+    '''
+    try:
+        roi = tuple(int(value) for value in text.split(','))
+    except ValueError:
+        roi = ()
+    if len(roi) != 4:
+        raise ValueError('the ROI must be written as rowmin,rowmax,colmin,colmax')
+    return roi
+
+
+def parse_value_range (text):
+    '''
+    This function converts the range of values written in the configuration
+    file as "minimum,maximum" to a tuple of floats.
+
+    Parameters
+    ----------
+    text : str
+        the minimum and the maximum separated by a comma, or an empty string
+
+    Returns
+    -------
+    value_range : tuple or None
+        (minimum,maximum), or None if text is empty
+
+    Raises
+    ------
+    ValueError
+        if text does not contain 2 numbers separated by a comma
+    '''
+    if text.strip() == '':
+        return None
+    try:
+        value_range = tuple(float(value) for value in text.split(','))
+    except ValueError:
+        value_range = ()
+    if len(value_range) != 2:
+        raise ValueError('the range of values must be written as minimum,maximum')
+    return value_range
+
+
+def parse_row_ranges (text):
+    '''
+    This function converts the ranges of rows written in the configuration file
+    as "ymin-ymax, ymin-ymax, ..." to a list of tuples of integers.
+
+    Parameters
+    ----------
+    text : str
+        the ranges of rows separated by commas
+
+    Returns
+    -------
+    row_ranges : list
+        list of tuples (ymin,ymax)
+
+    Raises
+    ------
+    ValueError
+        if a range is not written as ymin-ymax
+    '''
+    row_ranges = []
+    for item in text.split(','):
+        try:
+            ymin, ymax = (int(value) for value in item.split('-'))
+        except ValueError:
+            raise ValueError('the ranges of rows must be written as ymin-ymax, separated by commas')
+        row_ranges.append((ymin, ymax))
+    return row_ranges
+
+
+def read_references (flatpath,darkpath,reference_mode,tomo_stack,scratch_dir=None,roi=None):
+    '''
+    This function reads the flat and dark images and returns them
+    as 3D arrays with the same dimensions of the stack of projections.
+
+    Parameters
+    ----------
+    flatpath : str
+        path to the directory containing the flat images
+    darkpath : str
+        path to the directory containing the dark images
+    reference_mode : str
+        'stack' to keep all the flat and dark images, 'mean' or 'median'
+        to combine them in a single reference image
+    tomo_stack : ndarray
+        3D array of the tomographic projections, taken as reference
+    scratch_dir : str, optional
+        directory of the memory-mapped files where the 3D arrays are stored.
+        Default is None (arrays in memory)
+    roi : tuple, optional
+        coordinates (rowmin,rowmax,colmin,colmax) of the ROI: if given, the flat and
+        dark images are cropped as the projections read with the same ROI. Default is None
+
+    Returns
+    -------
+    flat_stack : ndarray
+        3D array of the flat images
+    dark_stack : ndarray
+        3D array of the dark images
+    '''
+    if reference_mode == 'stack':
+        #lists of images
+        flat_list = preparation_data.reader_gray_images(flatpath)
+        dark_list = preparation_data.reader_gray_images(darkpath)
+    else:
+        #flat and dark images combined in a single reference image
+        flat_list = [preparation_data.reference_image(flatpath,reference_mode)]
+        dark_list = [preparation_data.reference_image(darkpath,reference_mode)]
+
+    if roi is not None:
+        rowmin,rowmax,colmin,colmax = roi
+        flat_list = [img[rowmin:rowmax,colmin:colmax] for img in flat_list]
+        dark_list = [img[rowmin:rowmax,colmin:colmax] for img in dark_list]
+
+    #3D arrays of images
+    flat_stack = preparation_data.create_array(flat_list,tomo_stack,scratch_dir)
+    dark_stack = preparation_data.create_array(dark_list,tomo_stack,scratch_dir)
+
+    return flat_stack, dark_stack
+
+
+def select_ROI (args,ref_proj,datapath,roi=None):
+    '''
+    This function lets the user draw the ROI used for cropping the images,
+    if required by the optional arguments, and saves its coordinates in results.json.
+    If the coordinates of the ROI are given (headless mode), no window is shown.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the arguments of the command line
+    ref_proj : ndarray
+        2D array of the projection where the ROI is drawn
+    datapath : str
+        path of the directory where results.json is saved
+    roi : tuple, optional
+        coordinates (rowmin,rowmax,colmin,colmax) of the ROI read from the configuration file.
+        Default is None (the user draws the ROI)
+
+    Returns
+    -------
+    roi : tuple or None
+        coordinates (rowmin,rowmax,colmin,colmax) of the ROI, None if cropping is not required
+    '''
+    if not args.roi:
+        return None
+    if roi is None:
+        import user_interaction     #graphical module imported only when needed
+        roi = user_interaction.draw_ROI(ref_proj,'selection of ROI')
+    rowmin,rowmax,colmin,colmax = roi
+    preprocess_and_correction.save_ROI(rowmin,rowmax,colmin,colmax,datapath)
+    return rowmin,rowmax,colmin,colmax
+
+
+def preprocessing (args,tomo_stack,dark_stack,flat_stack,roi,radius_neighborhood,outliers=None,scratch_dir=None,workers=1,threshold=0.02,k=1.0,median='exact'):
+    '''
+    This function performs the preprocessing required by the optional arguments
+    (cropping, normalization and outliers filter) on the stack of projections.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the arguments of the command line
+    tomo_stack : ndarray
+        3D array of the tomographic projections
+    dark_stack : ndarray
+        3D array of the dark images
+    flat_stack : ndarray
+        3D array of the flat images
+    roi : tuple or None
+        coordinates (rowmin,rowmax,colmin,colmax) of the ROI used for cropping (see select_ROI())
+    radius_neighborhood : int
+        neighborhood radius for outlier filtering
+    outliers : str, optional
+        type of outliers to remove ('bright', 'dark' or 'both').
+        Default is None (the user is asked to choose it)
+    scratch_dir : str, optional
+        directory of the memory-mapped files where the preprocessed stacks are stored.
+        Default is None (stacks in memory)
+    workers : int, optional
+        number of threads used for the normalization and the outliers filter. Default value is 1
+    threshold : float, optional
+        global threshold for outlier filtering. Default value is 0.02
+    k : float, optional
+        factor of the threshold for outlier filtering. Default value is 1.0
+    median : str, optional
+        median used for outlier filtering ('exact' or 'separable'). Default value is 'exact'
+
+    Returns
+    -------
+    tomo_stack : ndarray
+        3D array of the preprocessed tomographic projections
+    '''
+    #cropping
+    if roi is not None:
+        rowmin,rowmax,colmin,colmax = roi
+        print('> Tomographic projections:')
+        tomo_stack = preprocess_and_correction.cropping(tomo_stack,rowmin,rowmax,colmin,colmax,scratch_dir)
+
+    #normalization
+    if args.norm:
+        if roi is not None:
+            print('> Dark images:')
+            dark_stack = preprocess_and_correction.cropping(dark_stack,rowmin,rowmax,colmin,colmax,scratch_dir)
+            print('> Flat images:')
+            flat_stack = preprocess_and_correction.cropping(flat_stack,rowmin,rowmax,colmin,colmax,scratch_dir)
+        tomo_stack = preprocess_and_correction.normalization(tomo_stack, dark_stack, flat_stack, scratch_dir, workers=workers, in_place=True)
+    #outlier filter
+    if args.out:
+        tomo_stack = preprocess_and_correction.outliers_filter(tomo_stack,radius_neighborhood,k=k,outliers=outliers,threshold=threshold,median=median,workers=workers)
+
+    return tomo_stack
+
+
+def estimate_axis (tomo_stack_0,tomo_stack_180,datapath,y_of_ROIs=None,cache_dir=None,**search_options):
+    '''
+    This function estimates the offset and the tilt angle of the axis of rotation
+    with the ROIs selected by the user, shows the results and asks the user whether
+    to accept them, to estimate them again or to abort the script.
+    If the rows of the ROIs are given (headless mode), the estimate is computed
+    just once, without any window or question.
+    The rows, their shifts and the linear fit of the accepted estimate are saved
+    in results.json (see record.update_record()).
+    If cache_dir is given and the rows are given (headless mode), the estimate is saved
+    in the cache with a key computed from the content of the two projections, the rows
+    and the search options (see record.axis_key()): when the same projections are
+    processed again with the same rows and options, the estimate is read from the cache
+    and not computed again. When the user selects the ROIs the cache is not used, since
+    the rows are not known before the estimate and each estimate must be accepted by the user.
+
+    Parameters
+    ----------
+    tomo_stack_0 : ndarray
+        2D array of the projection at 0°
+    tomo_stack_180 : ndarray
+        2D array of the projection at 180°
+    datapath : str
+        path of the directory where results.json is saved
+    y_of_ROIs : ndarray, optional
+        1D array of the rows used for the estimate (see preprocess_and_correction.rows_for_correction()).
+        Default is None (the user selects the ROIs)
+    cache_dir : str, optional
+        directory of the cache of the estimates, used just if y_of_ROIs is given. Default is None (no cache)
+    search_options
+        optional arguments of preprocess_and_correction.find_shift_and_tilt_angle()
+
+    Returns
+    -------
+    middle_shift : int or float
+        the shift used for the correction of the images
+    theta : float
+        the tilt angle of the rotation axis (in degrees)
+    offset : int or float
+        the offset of the axis of rotation (in px, see preprocess_and_correction.find_shift_and_tilt_angle())
+    '''
+    if y_of_ROIs is not None:
+        if cache_dir:
+            key = record.axis_key(tomo_stack_0,tomo_stack_180,rows=y_of_ROIs,**search_options)
+            cached = record.read_cached_axis(cache_dir,key)
+            if cached is not None:
+                print('> Axis of rotation read from the cache:', key)
+                record.update_record(datapath,fit=cached['fit'],cache=key)
+                return cached['shift'], cached['theta'], cached['fit']['offset']
+
+        m,q,shift,offset,middle_shift, theta = preprocess_and_correction.find_shift_and_tilt_angle(y_of_ROIs,tomo_stack_0,tomo_stack_180,**search_options)
+        fit = dict(rows=y_of_ROIs,shifts=shift,m=m,q=q,offset=offset)
+        record.update_record(datapath,fit=fit)
+        if cache_dir:
+            record.cache_axis(cache_dir,key,dict(shift=middle_shift,theta=theta,fit=fit))
+        return middle_shift, theta, offset
+
+    import user_interaction     #graphical module imported only when needed
+    condition = True
+    while condition:
+        y_of_ROIs = user_interaction.ROIs_for_correction(tomo_stack_0,ystep=5)
+        m,q,shift,offset,middle_shift, theta = preprocess_and_correction.find_shift_and_tilt_angle(y_of_ROIs,tomo_stack_0,tomo_stack_180,**search_options)
+        user_interaction.graph_axis_rotation(tomo_stack_0,tomo_stack_180,y_of_ROIs,m,q,shift,offset,middle_shift, theta)
+
+        ans= user_interaction.user_choice_for_correction()
+        if(ans=='Y' or ans=='y'):
+            condition = False
+            break
+        elif(ans=='N' or ans=='n'):
+            condition = True
+        elif(ans=='C' or ans=='c'):
+            print('> Script aborted.')
+            record.delete_record(datapath)      #remove results.json file if it exists
+            sys.exit()
+        else:
+            print('Input not valid.')
 
+    record.update_record(datapath,fit=dict(rows=y_of_ROIs,shifts=shift,m=m,q=q,offset=offset))
+    return middle_shift, theta, offset
+
+
+def images_source (inputs,roi,shift,theta,**preprocessing):
+    '''
+    This function returns the description of the corrected images saved by a run,
+    recorded in the checkpoint of the saved images (see preprocess_and_correction.ImageWriter):
+    a run is resumed (optional argument -resume) just if the description is the same.
+
+    Parameters
+    ----------
+    inputs : dict
+        the checksums of the projections, flat and dark images (see record.files_checksum())
+    roi : tuple or None
+        coordinates (rowmin,rowmax,colmin,colmax) of the ROI used to crop the images
+    shift : int or float
+        the shift used for the correction of the images
+    theta : float
+        the tilt angle of the rotation axis (in degrees)
+    preprocessing
+        the options of the preprocessing of the images
+
+    Returns
+    -------
+    source : dict
+        the description of the corrected images
+    '''
+    return dict(inputs=inputs, roi=roi, shift=shift, theta=theta, preprocessing=preprocessing)
+
+
+def read_config (config_file):
+    '''
+    This function reads the configuration file.
+
+    Parameters
+    ----------
+    config_file : str
+        path of the configuration file
+
+    Returns
+    -------
+    config : configparser.ConfigParser
+        the content of the configuration file
+
+    Raises
+    ------
+    OSError
+        if the configuration file does not exist
+    '''
     config = configparser.ConfigParser()
 
-    if os.path.isfile(args.config_file):
-        config.read(str(args.config_file))
+    if os.path.isfile(config_file):
+        config.read(str(config_file))
     else:
-        raise OSError ('file {0} does not exist'.format(args.config_file))
-
+        raise OSError ('file {0} does not exist'.format(config_file))
+    return config
+
+
+def run (args,config):
+    '''
+    This function runs the whole pipeline (reading, preprocessing, estimate of the
+    axis of rotation and correction of the images) as required by the arguments
+    of the command line, with the parameters of the configuration file.
+    A new record of the results (results.json, see record.py) is written for each run,
+    with the checksums of the input files, the ROI, the estimate of the axis of rotation,
+    the residual and the time spent in each stage.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the arguments of the command line (see parse_args())
+    config : configparser.ConfigParser
+        the content of the configuration file (see read_config())
+
+    Returns
+    -------
+    results : dict
+        the offset ('offset'), the shift used for the correction ('shift') and the tilt
+        angle ('theta') of the axis of rotation and the mean absolute difference between the projection at 0° and the flipped one
+        at 180° after the correction ('residual')
+    '''
 
     filepath = config.get('directories','dirpath_tomo')         #path to the tomographic projections
     flatpath = config.get('directories','dirpath_flat')         #path to the flat image/es
     darkpath = config.get('directories','dirpath_dark')         #path to the dark image/es
 
-    datapath = config.get('final files','dirpath_data')         #path for the data.txt file with coordinates of ROI, offset and tilt angle
+    datapath = config.get('final files','dirpath_data')         #path for the results.json file with coordinates of ROI, offset and tilt angle
     new_filepath = config.get('final files','filepath')         #path and the prefix of the name of the final files to be  saved in the specified folder
     digits = config.getint('final files','digits')              #number of digits to put in the final part of the final filenames to represent the index of the projections
                                                                 #(ex. digit=4 -> filename_0000.tiff,filename_0001.tiff,...)
+    output_dtype = config.get('final files','dtype',fallback='') or None           #type of the saved images ('float32', 'uint16' or None: type of the images)
+    value_range = parse_value_range(config.get('final files','value_range',fallback=''))   #values rescaled to 0 and 65535 in uint16 images
+    write_workers = config.getint('final files','write_workers',fallback=2)        #number of threads writing the corrected images
+    max_pending = config.getint('final files','max_pending',fallback=16)           #maximum number of images waiting to be written
 
-    last_angle = config.getint('angle','angle')                 #last angle of tomographic acquisition
-    
-    if args.out:                                                #read neighborhood radius only if outlier filter is required
-        radius_neighborhood = config.getint('outlier filter','radius_neighborhood') #neighborhood radius for outlier filtering
+    read_workers = config.getint('directories','workers',fallback=4)    #number of threads reading the tomographic projections
+    file_index = config.get('directories','file_index',fallback='')     #optional text file listing the projections in order of acquisition
+    reference_mode = config.get('directories','reference',fallback='stack') #how flat and dark images are used: 'stack', 'mean' or 'median'
+    scratch_dir = config.get('directories','scratch_dir',fallback='')   #optional directory of the memory-mapped files of the stacks (empty: stacks in memory)
 
+    last_angle = config.getint('angle','angle')                 #last angle of tomographic acquisition
 
-    #lists of images
-    tomo_list = preparation_data.reader_gray_images(filepath)
-    flat_list = preparation_data.reader_gray_images(flatpath)
-    dark_list = preparation_data.reader_gray_images(darkpath)
+    search_options = dict(
+        method = config.get('axis estimation','method',fallback='direct'),          #method used to compute the errors for all the shifts ('direct', 'fft' or 'pyramid')
+        subpixel = config.getboolean('axis estimation','subpixel',fallback=False),  #sub-pixel estimation of the shift
+        downsampling = config.getint('axis estimation','downsampling',fallback=4),  #downsampling factor for the coarse search ('pyramid' method)
+        window = config.getint('axis estimation','window',fallback=3))              #half width of the window of shifts searched for each row ('pyramid' method)
+    cache_dir = config.get('axis estimation','cache_dir',fallback='') or None       #optional directory of the cache of the estimates (empty: no cache)
 
+    workers = config.getint('correction','workers',fallback=1)             #number of threads used for the correction of the images
+    chunk_size = config.getint('correction','chunk_size',fallback=8)       #number of images corrected by a thread at a time
+    stream_chunk_size = config.getint('correction','stream_chunk_size',fallback=64) #number of projections kept in memory at a time with -stream
 
-    #3D arrays of images
-    tomo_stack = preparation_data.create_array(tomo_list,tomo_list)
-    flat_stack = preparation_data.create_array(flat_list,tomo_list)
-    dark_stack = preparation_data.create_array(dark_list,tomo_list)
+    radius_neighborhood = None
+    outliers = None
+    if args.out:                                                #read the parameters of the filter only if outlier filter is required
+        radius_neighborhood = config.getint('outlier filter','radius_neighborhood') #neighborhood radius for outlier filtering
+        outliers = config.get('outlier filter','outliers',fallback='') or None      #type of outliers to remove (None: the user is asked)
+    outlier_options = dict(
+        threshold = config.getfloat('outlier filter','threshold',fallback=0.02),   #global threshold of the deviation from the median
+        k = config.getfloat('outlier filter','k',fallback=1.0),                   #factor of the threshold
+        median = config.get('outlier filter','median',fallback='exact'))          #median used by the filter ('exact' or 'separable')
+
+    config_roi = None
+    y_of_ROIs = None
+    accept = True
+    if args.headless:                                           #all the choices of the user are read from the configuration file
+        if args.roi:
+            config_roi = parse_ROI(config.get('headless','roi'))                    #coordinates of the ROI for cropping
+        y_of_ROIs = preprocess_and_correction.rows_for_correction(parse_row_ranges(config.get('headless','rows')),
+                                                                  ystep=config.getint('headless','ystep',fallback=5))   #rows used to estimate the axis of rotation
+        if args.out and outliers is None:
+            outliers = config.get('headless','outliers',fallback='both')            #type of outliers to remove
+        accept = config.getboolean('headless','accept',fallback=True)               #whether to correct the images once the axis is estimated
+
+    #new record of the results: the values of the previous runs are not kept
+    timer = record.StageTimer()
+    inputs = dict(projections=record.files_checksum(preparation_data.tiff_files(filepath,file_index)),
+                  flat=record.files_checksum(preparation_data.tiff_files(flatpath)),
+                  dark=record.files_checksum(preparation_data.tiff_files(darkpath)))
+    record.write_record(datapath,dict(inputs=inputs))
+
+
+    if args.estimate or args.stream:
+        #just the projections at 0° and 180° are read
+        file_0, file_180 = preparation_data.files_0_180(last_angle,filepath,file_index)
+        tomo_stack = preparation_data.read_images([file_0,file_180],workers=2)
+        #all the flat and dark images are averaged by the normalization, so they can be combined in advance
+        if reference_mode == 'stack':
+            reference_mode = 'mean'
+        flat_stack, dark_stack = read_references(flatpath,darkpath,reference_mode,tomo_stack)
+        timer.lap('reading')
+
+        roi = select_ROI(args,tomo_stack[0],datapath,config_roi)
+        if args.out and outliers is None:                       #the same type of outliers is removed from all the chunks
+            outliers = preprocess_and_correction.outliers_type()
+        two_proj = preprocessing(args,tomo_stack,dark_stack,flat_stack,roi,radius_neighborhood,outliers,**outlier_options)
+        timer.lap('preprocessing')
+
+        middle_shift, theta, offset = estimate_axis(two_proj[0],two_proj[1],datapath,y_of_ROIs,cache_dir,**search_options)
+        results = dict(offset=offset, shift=middle_shift, theta=theta,
+                       residual=preprocess_and_correction.residual(two_proj[0],two_proj[1],middle_shift,theta))
+        timer.lap('estimate')
+        if args.estimate or not accept:
+            preprocess_and_correction.save_axis(middle_shift,theta,datapath)
+            record.update_record(datapath,residual=results['residual'],timings=timer.timings)
+            return results
+
+        #all the projections are corrected chunk by chunk
+        files = preparation_data.tiff_files(filepath,file_index)
+        dark, flat = (dark_stack[0], flat_stack[0]) if args.norm else (None, None)
+        source = images_source(inputs,roi,middle_shift,theta,norm=args.norm,reference=reference_mode,
+                               outliers=dict(radius=radius_neighborhood,outliers=outliers,**outlier_options) if args.out else None)
+        writer = preprocess_and_correction.ImageWriter(new_filepath,digits,write_workers,max_pending,output_dtype,value_range,args.resume,
+                                                       shape=two_proj[0].shape,source=source)
+        preprocess_and_correction.correction_stream(files,middle_shift,theta,datapath,new_filepath,digits,roi=roi,dark=dark,flat=flat,
+                                                    radius_2D_neighborhood=radius_neighborhood,outliers=outliers,chunk_size=stream_chunk_size,workers=workers,
+                                                    writer=writer,**outlier_options)
+        timer.lap('correction')
+        record.update_record(datapath,residual=results['residual'],timings=timer.timings)
+        return results
+
+
+    #3D array of tomographic projections: if the ROI is known in advance, just the ROI of the images is read
+    tomo_stack = preparation_data.read_stack(filepath,workers=read_workers,file_index=file_index,scratch_dir=scratch_dir,roi=config_roi)
+    flat_stack, dark_stack = read_references(flatpath,darkpath,reference_mode,tomo_stack,scratch_dir,config_roi)
 
     #projection at 0° and at 180°
     tomo_0,tomo_180 = preparation_data.projection_0_180(last_angle,tomo_stack)
+    timer.lap('reading')
 
-    
 
-    print('> Reading the images...')
-    #show all the images in the stack scrolling through them with arrow keys
-    plot_tracker(tomo_stack)
 
+    if not args.headless:
+        from show_stack import plot_tracker     #graphical module imported only when needed
+        print('> Reading the images...')
+        #show all the images in the stack scrolling through them with arrow keys
+        plot_tracker(tomo_stack)
 
-    #cropping
-    if args.roi:
-        rowmin,rowmax,colmin,colmax = user_interaction.draw_ROI(tomo_0,'selection of ROI')
-        preprocess_and_correction.save_ROI(rowmin,rowmax,colmin,colmax,datapath)
-        print('> Tomographic projections:')
-        tomo_stack = preprocess_and_correction.cropping(tomo_stack,rowmin,rowmax,colmin,colmax)
-        
-    #normalization
-    if args.norm:
-        print('> Dark images:')
-        dark_stack = preprocess_and_correction.cropping(dark_stack,rowmin,rowmax,colmin,colmax)
-        print('> Flat images:')
-        flat_stack = preprocess_and_correction.cropping(flat_stack,rowmin,rowmax,colmin,colmax)
-        tomo_stack = preprocess_and_correction.normalization(tomo_stack, dark_stack, flat_stack)
-    #outlier filter
-    if args.out:
-        tomo_stack = preprocess_and_correction.outliers_filter(tomo_stack,radius_neighborhood)
-        
 
+    roi = select_ROI(args,tomo_0,datapath,config_roi)
+    if config_roi is not None:                                  #the images were cropped while reading them
+        roi = None
+    if args.out and outliers is None:                           #the type of outliers is also recorded with the saved images
+        outliers = preprocess_and_correction.outliers_type()
+    tomo_stack = preprocessing(args,tomo_stack,dark_stack,flat_stack,roi,radius_neighborhood,outliers,scratch_dir,workers,**outlier_options)
+    timer.lap('preprocessing')
 
 
     #select projections at 0° and 180°
     tomo_stack_0, tomo_stack_180 = preparation_data.projection_0_180(last_angle,tomo_stack)
 
 #find axis and correction
-    condition = True
-    while condition:
-        y_of_ROIs = user_interaction.ROIs_for_correction(tomo_stack_0,ystep=5)
-        m,q,shift,offset,middle_shift, theta = preprocess_and_correction.find_shift_and_tilt_angle(y_of_ROIs,tomo_stack_0,tomo_stack_180)
-        user_interaction.graph_axis_rotation(tomo_stack_0,tomo_stack_180,y_of_ROIs,m,q,shift,offset,middle_shift, theta)
-        
-        ans= user_interaction.user_choice_for_correction()
-        if(ans=='Y' or ans=='y'):
-            condition = False
-            break
-        elif(ans=='N' or ans=='n'):
-            condition = True
-        elif(ans=='C' or ans=='c'):
-            print('> Script aborted.')
-            if os.path.exists(os.path.join(datapath,"data.txt")):  #remove data.txt file if it exists
-                os.remove(os.path.join(datapath,"data.txt"))
-                sys.exit()
-            else:
-                sys.exit()
-        else:
-            print('Input not valid.')
-
-    tomo_stack_corrected = preprocess_and_correction.correction_axis_rotation(tomo_stack,middle_shift,theta,datapath)
-    preprocess_and_correction.save_images(new_filepath,tomo_stack_corrected,digits)
-
-
-
-if __name__ == '__main__':
-    main()
-
-
+    middle_shift, theta, offset = estimate_axis(tomo_stack_0,tomo_stack_180,datapath,y_of_ROIs,cache_dir,**search_options)
+    results = dict(offset=offset, shift=middle_shift, theta=theta,
+                   residual=preprocess_and_correction.residual(tomo_stack_0,tomo_stack_180,middle_shift,theta))
+    timer.lap('estimate')
+    if not accept:
+        preprocess_and_correction.save_axis(middle_shift,theta,datapath)
+        record.update_record(datapath,residual=results['residual'],timings=timer.timings)
+        return results
+
+    if output_dtype == 'uint16' and value_range is None:
+        #the resample copies the values of the edges outside the field of view (see preprocess_and_correction.rotate_and_shift()),
+        #so the corrected images have just the values of the projections
+        value_range = (float(tomo_stack.min()), float(tomo_stack.max()))
+    #the corrected images are saved while the other ones are corrected
+    print('> The corrected images are saved in', new_filepath + '_' + '#'*digits + '.tiff')
+    source = images_source(inputs,config_roi if config_roi is not None else roi,middle_shift,theta,norm=args.norm,reference=reference_mode,
+                           outliers=dict(radius=radius_neighborhood,outliers=outliers,**outlier_options) if args.out else None)
+    with preprocess_and_correction.ImageWriter(new_filepath,digits,write_workers,max_pending,output_dtype,value_range,args.resume,
+                                               shape=tomo_stack.shape[1:],source=source) as writer:
+        preprocess_and_correction.correction_axis_rotation(tomo_stack,middle_shift,theta,datapath,workers=workers,chunk_size=chunk_size,show=not args.headless,writer=writer)
+    timer.lap('correction')
+    record.update_record(datapath,residual=results['residual'],timings=timer.timings)
+
+    return results
+
+
+def use_headless_backend ():
+    '''
+    This function makes matplotlib use a non-interactive backend, so no window can be opened.
+    If matplotlib is not imported yet, it is not imported here: the backend is set
+    through the environment variable MPLBACKEND, so the start of the program is not slowed down.
+    '''
+    if 'matplotlib' in sys.modules:
+        import matplotlib
+        matplotlib.use('Agg')
+    else:
+        os.environ['MPLBACKEND'] = 'Agg'
 
 
+def main (argv=None):
 
+    args = parse_args(argv)
 
+    if args.headless:
+        use_headless_backend()
 
+    run(args,read_config(args.config_file))
 
 
 
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,171 @@
-import cv2
 import glob
 import numpy as np
 import os
+import re
+import tempfile
+import tifffile
+from concurrent.futures import ThreadPoolExecutor
+
+#key for the natural (numeric-aware) sorting of the filenames
+def natural_sort_key (filename):
+    '''
+    This function returns the key used to sort the filenames in natural order,
+    that is comparing the groups of digits as numbers and not as characters
+    (ex. proj_2.tiff comes before proj_10.tiff).
+
+    Parameters
+    ----------
+    filename : str
+        path or name of the file
+
+    Returns
+    -------
+    key : list
+        list of strings (lowercase) and integers obtained splitting the name of the file
+        in groups of digits and non digits
+    '''
+    name = os.path.basename(filename)
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+#list of the .tiff files contained in a directory
+def tiff_files (filepath,file_index=None):
+    '''
+    This function returns the list of the paths of the .tiff files
+    contained in the directory whose path is expressed by filepath.
+    The files are sorted in natural order (see natural_sort_key()), so the
+    order does not depend on the filesystem or on the number of digits
+    of the numbering.
+    If file_index is given, the files are the ones listed in that text file,
+    one per line and in the order of acquisition (empty lines and lines
+    starting with # are ignored). The names are relative to filepath.
+
+    Parameters
+    ----------
+    filepath : str
+        path to the directory containing the .tiff files
+    file_index : str, optional
+        path of the text file listing the files to read. Default is None
+
+    Returns
+    -------
+    files : list
+        list of strings representing the paths of the .tiff files
+
+    Raises
+    ------
+    OSError
+        when the directory does not contain any .tiff file
+    OSError
+        when the directory does not exist
+    OSError
+        when a file listed in file_index does not exist
+    '''
+    if os.path.isdir(filepath):
+        if file_index:
+            with open(file_index) as index:
+                names = [line.strip() for line in index if line.strip() and not line.strip().startswith('#')]
+            files = [os.path.join(filepath,name) for name in names]
+            for filename in files:
+                if not os.path.isfile(filename):
+                    raise OSError('file {0} listed in {1} does not exist'.format(filename,file_index))
+        else:
+            files = sorted(glob.glob(os.path.join(filepath,'*.tiff')), key=natural_sort_key)
+        if len(files)==0:
+            raise OSError('directory {0} does not contain any .tiff file'.format(filepath))
+        else:
+            return files
+    else:
+        raise OSError('directory {0} does not exist'.format(filepath))
+
+
+#reader of a single gray scaled image
+def read_gray_image (filename,roi=None):
+    '''
+    This function reads a .tiff gray scaled image, keeping its bit depth.
+    If the coordinates of a ROI are given, just the ROI is returned: when the
+    image is not compressed the file is memory-mapped (tifffile.memmap) and
+    just the rows of the ROI are read from the disk, otherwise the whole image
+    is decoded and then cropped.
+
+    Parameters
+    ----------
+    filename : str
+        path of the .tiff file
+    roi : tuple, optional
+        coordinates (rowmin,rowmax,colmin,colmax) of the ROI to read.
+        Default is None (whole image)
+
+    Returns
+    -------
+    im : ndarray
+        2D array representing the image (or its ROI)
+
+    Raises
+    ------
+    OSError
+        when the file can not be read
+    '''
+    if roi is not None:
+        rowmin,rowmax,colmin,colmax = roi
+        try:
+            im = tifffile.memmap(filename, mode='r')
+        except Exception:       #compressed or not valid files are decoded by OpenCV
+            im = None
+        if im is not None and im.ndim == 2:
+            return np.array(im[rowmin:rowmax,colmin:colmax])
+    import cv2      #imported only when needed, since it slows down the start of the program
+    im = cv2.imread(filename,flags=(cv2.IMREAD_GRAYSCALE | cv2.IMREAD_ANYDEPTH)) #gray_image reading (default is RGB reading)
+    if im is None:
+        raise OSError('file {0} can not be read'.format(filename))
+    if roi is not None:
+        im = im[rowmin:rowmax,colmin:colmax]
+    return im
+
+
+def image_shape (filename):
+    '''
+    This function returns the shape of a .tiff gray scaled image reading just the
+    header of the file, if possible (otherwise the image is read, see read_gray_image()).
+
+    Parameters
+    ----------
+    filename : str
+        path of the .tiff file
+
+    Returns
+    -------
+    shape : tuple
+        the number of rows and columns of the image
+
+    Raises
+    ------
+    OSError
+        when the file can not be read
+    '''
+    try:
+        with tifffile.TiffFile(filename) as tif:
+            shape = tif.pages[0].shape
+        if len(shape) == 2:
+            return tuple(shape)
+    except Exception:       #not valid files are read by OpenCV
+        pass
+    return read_gray_image(filename).shape
+
 
 #reader of the images that returns a list of images
-def reader_gray_images (filepath):
+def reader_gray_images (filepath,file_index=None):
     '''
     This function reads the .tiff gray scaled images contained in the directory
     whose path is expressed by filepath and returns a list of two dimensional
-    arrays representing the images
+    arrays representing the images, in the order given by tiff_files()
     
     Parameters
     ----------
     filepath : str
         path to the directory containing the .tiff files
+    file_index : str, optional
+        path of the text file listing the files to read (see tiff_files()). Default is None
         
     Returns
     -------
@@ -27,44 +179,244 @@ def reader_gray_images (filepath):
     OSError
         when the directory does not exist
     '''
-    image_list = []
-    files = os.path.join(filepath,'*.tiff')
+    return [read_gray_image(filename) for filename in tiff_files(filepath,file_index)]
+
+
+#3D array in memory or in a memory-mapped scratch file
+def allocate_stack (shape,dtype=np.float32,scratch_dir=None):
+    '''
+    This function allocates an empty three dimensional array.
+    If scratch_dir is given, the array is a numpy.memmap stored in a temporary
+    file of that directory, so the stack can be larger than the RAM (the
+    operating system keeps in memory just the parts of the file in use).
+    The temporary file is deleted when the array is not used anymore.
+
+    Parameters
+    ----------
+    shape : tuple
+        the shape of the array
+    dtype : data-type, optional
+        the data type of the array. Default is np.float32
+    scratch_dir : str, optional
+        path of the directory of the temporary file. Default is None (array in memory)
+
+    Returns
+    -------
+    img_stack : ndarray or numpy.memmap
+        the empty 3D array
+
+    Raises
+    ------
+    OSError
+        when scratch_dir does not exist
+    '''
+    if not scratch_dir:
+        return np.empty(shape, dtype=dtype)
+    if not os.path.isdir(scratch_dir):
+        raise OSError('directory {0} does not exist'.format(scratch_dir))
+    with tempfile.TemporaryFile(dir=scratch_dir, suffix='.dat') as file:
+        #the mapping stays valid after the file is closed
+        return np.memmap(file, dtype=dtype, mode='w+', shape=shape)
+
+
+#reader of a list of images that returns directly the 3D array
+def read_images (files,workers=4,scratch_dir=None,roi=None):
+    '''
+    This function reads a list of .tiff gray scaled images and returns them as
+    a three dimensional array of float32, keeping the order of the list.
+    The first image is read to know the dimensions of the images, then the
+    final array is allocated once (see allocate_stack()) and filled by a pool
+    of workers threads, so no intermediate list of images is created.
+
+    Parameters
+    ----------
+    files : list
+        list of strings representing the paths of the .tiff files
+    workers : int, optional
+        number of threads reading the images. Default value is 4
+    scratch_dir : str, optional
+        directory of the memory-mapped file where the stack is stored.
+        Default is None (stack in memory)
+    roi : tuple, optional
+        coordinates (rowmin,rowmax,colmin,colmax) of the ROI: if given, just the ROI
+        of each image is read and kept (see read_gray_image()). Default is None
+
+    Returns
+    -------
+    img_stack : ndarray
+        3D array (float32) representing the stack of read images
+
+    Raises
+    ------
+    ValueError
+        when the images have different dimensions
+    ValueError
+        when workers is lower than 1
+    ValueError
+        when rowmin>rowmax or colmin>colmax in roi
+    '''
+    if workers < 1:
+        raise ValueError('workers must be greater than zero')
+    if roi is not None and (roi[0] > roi[1] or roi[2] > roi[3]):
+        raise ValueError ('rowmin and colmin must be less than rowmax and colmax rispectively')
+
+    first = read_gray_image(files[0],roi)
+    img_stack = allocate_stack((len(files),) + first.shape, np.float32, scratch_dir)
+    img_stack[0] = first
+
+    def read_into (i):
+        im = read_gray_image(files[i],roi)
+        if im.shape != first.shape:
+            raise ValueError('{0} should contain images with the same dimensions'.format(os.path.dirname(files[i])))
+        img_stack[i] = im
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(read_into, range(1, len(files))):   #consume the results to raise the errors of the threads
+            pass
+
+    return img_stack
+
+
+#reader of the images that returns directly the 3D array
+def read_stack (filepath,workers=4,file_index=None,scratch_dir=None,roi=None):
+    '''
+    This function reads the .tiff gray scaled images contained in the directory
+    whose path is expressed by filepath and returns them as a three dimensional
+    array of float32, keeping the order of the files given by tiff_files().
+    The images are read by read_images().
+
+    Parameters
+    ----------
+    filepath : str
+        path to the directory containing the .tiff files
+    workers : int, optional
+        number of threads reading the images. Default value is 4
+    file_index : str, optional
+        path of the text file listing the files to read (see tiff_files()). Default is None
+    scratch_dir : str, optional
+        directory of the memory-mapped file where the stack is stored.
+        Default is None (stack in memory)
+    roi : tuple, optional
+        coordinates (rowmin,rowmax,colmin,colmax) of the ROI: if given, just the ROI
+        of each image is read and kept (see read_gray_image()). Default is None
+
+    Returns
+    -------
+    img_stack : ndarray
+        3D array (float32) representing the stack of read images
+
+    Raises
+    ------
+    OSError
+        when the directory does not contain any .tiff file
+    OSError
+        when the directory does not exist
+    ValueError
+        when the images have different dimensions
+    ValueError
+        when workers is lower than 1
+    ValueError
+        when rowmin>rowmax or colmin>colmax in roi
+    '''
+    return read_images(tiff_files(filepath,file_index),workers,scratch_dir,roi)
+
+
+#dark or flat images combined in a single reference image
+def reference_image (filepath,mode='mean',file_index=None,band_rows=64):
+    '''
+    This function combines the .tiff gray scaled images contained in the directory
+    whose path is expressed by filepath (dark or flat images) in a single
+    reference image, computing their pixel-wise mean or median.
+    The mean is accumulated reading one image at a time, so just one image
+    is kept in memory. The median needs all the values of each pixel, hence it is
+    computed on bands of band_rows rows: for each band just the rows of the band
+    are read from all the images (see read_gray_image()), so the images are never
+    kept in memory all at once.
+
+    Parameters
+    ----------
+    filepath : str
+        path to the directory containing the .tiff files
+    mode : str, optional
+        how the images are combined: 'mean' or 'median'. Default value is 'mean'
+    file_index : str, optional
+        path of the text file listing the files to read (see tiff_files()). Default is None
+    band_rows : int, optional
+        number of rows of the bands used to compute the median. Default value is 64
+
+    Returns
+    -------
+    ref_img : ndarray
+        2D array (float32) representing the reference image
+
+    Raises
+    ------
+    ValueError
+        when mode is different from 'mean' or 'median'
+    ValueError
+        when the images have different dimensions
+    '''
+    if mode not in ('mean','median'):
+        raise ValueError('the mode for the reference image must be mean or median')
+
+    files = tiff_files(filepath,file_index)
+
+    if mode == 'mean':
+        first = read_gray_image(files[0])
+        total = first.astype(np.float64)
+        for i in range(1,len(files)):
+            im = read_gray_image(files[i])
+            if im.shape != first.shape:
+                raise ValueError('{0} should contain images with the same dimensions'.format(filepath))
+            total += im
+        return (total / len(files)).astype(np.float32)
+
+    rows, cols = image_shape(files[0])
+    for filename in files[1:]:
+        if image_shape(filename) != (rows, cols):
+            raise ValueError('{0} should contain images with the same dimensions'.format(filepath))
+
+    ref_img = np.empty((rows, cols), dtype=np.float32)
+    for row in range(0, rows, band_rows):
+        stop = min(row + band_rows, rows)
+        band = None
+        for i, filename in enumerate(files):
+            im = read_gray_image(filename,(row,stop,0,cols))    #just the rows of the band
+            if band is None:
+                band = np.empty((len(files),) + im.shape, dtype=im.dtype)
+            band[i] = im
+        ref_img[row:stop] = np.median(band, axis=0)
+
+    return ref_img
 
-    if os.path.isdir(filepath):
-        for filename in glob.glob(files): 
-            im=cv2.imread(filename,flags=(cv2.IMREAD_GRAYSCALE | cv2.IMREAD_ANYDEPTH)) #0 stands for the gray_image reading (default is RGB reading)
-            image_list.append(im)
-        if len(image_list)==0:
-            raise OSError('directory {0} does not contain any .tiff file'.format(filepath))
-        else:
-            return image_list
-        
-    else:
-        raise OSError('directory {0} does not exist'.format(filepath))
-    
 
 #image list is transformed in a 3D array
-def create_array (img_list,img_list_tomo):
+def create_array (img_list,img_list_tomo,scratch_dir=None):
     '''
     This function transforms a list of two dimensional arrays 
     (representing gray scaled images) into a three dimensional array.
     The number of elements in the list can be 1 or the same of
     another list taken as a reference.
-    In the first case a 3D array is created using the same image repeated
-    untill reaching the required dimension.
-    In the second case the list is simply converted into a 3D array.
+    In the first case a read-only 3D view is returned, where the same image
+    is repeated (without copying it) untill reaching the required dimension.
+    In the second case the list is simply converted into a 3D array
+    (memory-mapped if scratch_dir is given, see allocate_stack()).
     
     Parameters
     ----------
     img_list : list
         list of 2D arrays that has to be converted to a 3D array
-    img_list_tomo : list
-        list of 2D array taken as reference
+    img_list_tomo : list or ndarray or tuple
+        list of 2D array (or 3D array, e.g. returned by read_stack()) taken as reference,
+        or directly the tuple with its shape (num of images, rows, columns)
+    scratch_dir : str, optional
+        directory of the memory-mapped file where the 3D array is stored.
+        Default is None (array in memory)
 
     Returns
     -------
     img_array : ndarray
-        3D array with the same dimensions of img_list_tomo converted to an array
+        3D array (float32) with the same dimensions of img_list_tomo converted to an array
 
     Raises
     ------
@@ -73,23 +425,93 @@ def create_array (img_list,img_list_tomo):
     ValueError
         when the dimensions of the 2D arrays of img_list are different from the ones of the 2D arrays of img_list_tomo 
     '''
-    im_dim = np.array(img_list[0]).shape
-    tomo_dim = np.array(img_list_tomo[0]).shape
-    if im_dim == tomo_dim:
-        if len(img_list) == len(img_list_tomo):
-            img_array = np.asarray(img_list, dtype=np.float32)
+    if isinstance(img_list_tomo, tuple):
+        tomo_shape = img_list_tomo
+    else:
+        tomo_shape = (len(img_list_tomo),) + np.shape(img_list_tomo[0])
+    im_dim = np.shape(img_list[0])
+    if im_dim == tomo_shape[1:]:
+        if len(img_list) == tomo_shape[0]:
+            if not scratch_dir:
+                return np.asarray(img_list, dtype=np.float32)
+            img_array = allocate_stack(tomo_shape, np.float32, scratch_dir)
+            for i in range(len(img_list)):
+                img_array[i] = img_list[i]
             return img_array
         elif len(img_list) == 1:
-            tomo_array = np.asarray(img_list_tomo)
-            img_array = np.full(tomo_array.shape,img_list, dtype=np.float32)
+            img_array = np.broadcast_to(np.asarray(img_list[0], dtype=np.float32), tomo_shape)
             return img_array
-        elif len(img_list) !=1 and len(img_list) != len(img_list_tomo):
+        elif len(img_list) !=1 and len(img_list) != tomo_shape[0]:
             raise ValueError('{0} should contain or 1 image or an amount of images equal to the num of tomographic projections'.format(img_list))
     else:
         raise ValueError('{0} should contain images with the same dimensions of tomographic projections'.format(img_list))
 
 
 
+#index of the tomographic projections at angle 0 and 180 degrees
+def index_0_180 (angle,nimages):
+    '''
+    This function returns the index of the projection acquired at 0° (the first one)
+    and the index of the one acquired at 180° (the last or the middle one, depending
+    if the tomographic acquisition is performed with a maximum angle rispectively
+    of 180° or 360°) in a stack of nimages projections.
+
+    Parameters
+    ----------
+    angle : int
+        integer representing the last angle of acquisition
+    nimages : int
+        number of projections of the tomography
+
+    Returns
+    -------
+    index_0 : int
+        index of the projection at 0°
+    index_180 : int
+        index of the projection at 180°
+
+    Raises
+    ------
+    ValueError
+        when angle is different from 180 or 360
+    '''
+    if angle == 360:
+        return 0, int((nimages-1)/2)
+    elif angle == 180:
+        return 0, int(nimages-1)
+    else:
+        raise ValueError('the maximum angle for the tomography must be 180 or 360 degrees')
+
+
+#files of the tomographic projections at angle 0 and 180 degrees
+def files_0_180 (angle,filepath,file_index=None):
+    '''
+    This function returns the paths of the .tiff files of the projections
+    acquired at 0° and at 180°, among the files contained in the directory
+    whose path is expressed by filepath (in the order given by tiff_files()),
+    without reading any image.
+
+    Parameters
+    ----------
+    angle : int
+        integer representing the last angle of acquisition
+    filepath : str
+        path to the directory containing the .tiff files
+    file_index : str, optional
+        path of the text file listing the files (see tiff_files()). Default is None
+
+    Returns
+    -------
+    file_0 : str
+        path of the projection at 0°
+    file_180 : str
+        path of the projection at 180°
+    '''
+    files = tiff_files(filepath,file_index)
+    index_0, index_180 = index_0_180(angle,len(files))
+    return files[index_0], files[index_180]
+
+
 #define tomographic projections at angle 0 and 180 degrees
 def projection_0_180 (angle,img_array):
     '''
@@ -116,13 +538,5 @@ def projection_0_180 (angle,img_array):
     ValueError
         when angle is different from 180 or 360
     '''
-    proj_0 = img_array[0,:,:]
-    if angle == 360:
-        proj_180 = img_array[int(((img_array.shape[0]-1)/2)),:,:]
-        return proj_0,proj_180
-    elif angle == 180:
-        proj_180 = img_array[int(img_array.shape[0]-1),:,:]
-        return proj_0,proj_180
-    else:
-        raise ValueError('the maximum angle for the tomography must be 180 or 360 degrees')
-    
\ No newline at end of file
+    index_0, index_180 = index_0_180(angle,img_array.shape[0])
+    return img_array[index_0,:,:], img_array[index_180,:,:]
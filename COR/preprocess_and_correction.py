@@ -1,16 +1,19 @@
-import neutompy as ntp
-import show_stack
+import preparation_data
+import record
+import json
 import numpy as np
 import os
-import SimpleITK as sitk
+import threading
+import tifffile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from neutompy.preproc.preproc import rotate_sitk as rotate_sitk
 
 
 def save_ROI (rowmin,rowmax,colmin,colmax,datapath):
     '''
-    This function creates or open a file called data.txt in the path datapath
-    and save the coordinates of the ROI.
+    This function saves the coordinates of the ROI in the record of the results
+    (results.json in the path datapath, see record.update_record()), replacing the
+    ones of a previous run.
     
     Parameters
     ----------
@@ -23,21 +26,86 @@ def save_ROI (rowmin,rowmax,colmin,colmax,datapath):
     colmax : int
         The maximum column coordinate
     datapath : str
-        string representing the directory path where to create data.txt 
+        string representing the directory path where results.json is placed
     '''
-    with open(os.path.join(datapath,'data.txt'),'a') as file:
-        file.write('rowmin {0} \nrowmax {1} \ncolmin {2} \ncolmax {3}'.format(rowmin,rowmax,colmin,colmax))
+    record.update_record(datapath,roi=dict(rowmin=rowmin,rowmax=rowmax,colmin=colmin,colmax=colmax))
 
 
-def cropping (img_stack,rowmin,rowmax,colmin,colmax):
+def is_repeated_image (img_stack):
+    '''
+    This function checks if a 3D array is a view of the same 2D image repeated
+    along the first axis (stride equal to 0, as the arrays created by
+    preparation_data.create_array() from a single image).
+
+    Parameters
+    ----------
+    img_stack : ndarray
+        3D array representing a stack of images
+
+    Returns
+    -------
+    repeated : bool
+        True if all the images of the stack are the same image in memory
+    '''
+    return img_stack.ndim == 3 and img_stack.shape[0] > 1 and img_stack.strides[0] == 0
+
+
+def reference_stack (ref_stack):
+    '''
+    This function returns the smallest 3D stack equivalent to a stack of dark
+    or flat images for the normalization, which uses their mean image:
+    a 2D image becomes a stack of one image, and a view of the same image
+    repeated is reduced to its first image, without copying data.
+
+    Parameters
+    ----------
+    ref_stack : ndarray
+        2D array or 3D array containing the dark or flat images
+
+    Returns
+    -------
+    ref_stack : ndarray
+        3D array containing the dark or flat images
+    '''
+    if ref_stack.ndim == 2:
+        return ref_stack[np.newaxis]
+    elif is_repeated_image(ref_stack):
+        return ref_stack[:1]
+    else:
+        return ref_stack
+
+
+def save_axis (shift,theta,datapath):
+    '''
+    This function saves the shift and the tilt angle of the axis of rotation in the
+    record of the results (results.json in the path datapath, see record.update_record()),
+    replacing the ones of a previous run.
+
+    Parameters
+    ----------
+    shift : int or float
+        shift of the axis of rotation with respect to the central vertical axis of the images (in px)
+    theta : float
+        the tilt angle of the rotation axis with respect to the central vertical axis of the images (in degrees)
+    datapath : str
+        string representing the directory path where results.json is placed
+    '''
+    print('>Writing shift and theta values in results.json file...')
+    record.update_record(datapath,shift=shift,theta=theta)
+
+
+def cropping (img_stack,rowmin,rowmax,colmin,colmax,scratch_dir=None):
     '''
     This function crops all the images contained in a stack according to
     specific coordinates. It returns the new stack with the cropped images.
+    If the images are already float32, no copy is made: the cropped stack
+    is a view that shares the memory with img_stack.
     
     Parameters
     ----------
     img_stack : ndarray
-        3D array representing the stack of gray scaled images
+        3D array representing the stack of gray scaled images.
+        If it is a view of the same image repeated, the cropped stack is a view too
     rowmin : int
         The minimum row coordinate
     rowmax : int
@@ -46,6 +114,10 @@ def cropping (img_stack,rowmin,rowmax,colmin,colmax):
         The minimum column coordinate
     colmax : int
         The maximum column coordinate
+    scratch_dir : str, optional
+        directory of the memory-mapped file where the cropped stack is stored
+        when a copy is needed (see preparation_data.allocate_stack()).
+        Default is None (stack in memory)
     
     Returns
     -------
@@ -59,60 +131,272 @@ def cropping (img_stack,rowmin,rowmax,colmin,colmax):
     '''
     print('> Cropping the images...')
     if rowmin <= rowmax and colmin <= colmax:
-        for i in range(img_stack.shape[0]):
-            img_stack_cropped = img_stack[:,rowmin:rowmax,colmin:colmax].astype(np.float32)
-        return img_stack_cropped
+        if is_repeated_image(img_stack):
+            #the same image repeated (see preparation_data.create_array()): just one image is cropped
+            img_cropped = img_stack[0,rowmin:rowmax,colmin:colmax].astype(np.float32)
+            return np.broadcast_to(img_cropped,(img_stack.shape[0],) + img_cropped.shape)
+        img_stack_cropped = img_stack[:,rowmin:rowmax,colmin:colmax]
+        if img_stack_cropped.dtype == np.float32:
+            return img_stack_cropped
+        if scratch_dir:
+            #the images are copied one at a time in the memory-mapped file
+            img_stack_copy = preparation_data.allocate_stack(img_stack_cropped.shape, np.float32, scratch_dir)
+            for i in range(img_stack_cropped.shape[0]):
+                img_stack_copy[i] = img_stack_cropped[i]
+            return img_stack_copy
+        return img_stack_cropped.astype(np.float32)
     else:
         raise ValueError ('rowmin and colmin must be less than rowmax and colmax rispectively')
 
 
-def normalization (img_stack,dark_stack,flat_stack):
+def normalize_slices (img_stack,out,start,stop,dark,den,min_ratio,max_ratio):
+    '''
+    This function normalizes the images of the stack with index from start
+    to stop (excluded) and writes the result in out, computing -log((I-D)/(F-D))
+    where the ratio is clamped between min_ratio and max_ratio.
+    All the operations are performed in place on the images of out, so no
+    temporary array is created. out can be img_stack itself.
+
+    Parameters
+    ----------
+    img_stack : ndarray
+        3D array containing the projection images
+    out : ndarray
+        3D array (float32) where the normalized images are written
+    start : int
+        index of the first image to normalize
+    stop : int
+        index after the last image to normalize
+    dark : ndarray
+        2D array (float32) of the mean dark image D
+    den : ndarray
+        2D array (float32) of the denominator F-D, already clamped to min_denom
+    min_ratio : float
+        minimum value of the ratio (I-D)/(F-D)
+    max_ratio : float
+        maximum value of the ratio (I-D)/(F-D)
+
+    Returns
+    -------
+    n : int
+        number of normalized images
+    '''
+    chunk = out[start:stop]
+    np.subtract(img_stack[start:stop], dark, out=chunk)
+    np.divide(chunk, den, out=chunk)
+    np.minimum(chunk, max_ratio, out=chunk)
+    np.maximum(chunk, min_ratio, out=chunk)
+    np.log(chunk, out=chunk)
+    np.negative(chunk, out=chunk)
+    return stop - start
+
+
+def normalization (img_stack,dark_stack,flat_stack,scratch_dir=None,chunk_size=16,workers=1,in_place=False,min_denom=1.0e-9,min_ratio=1.0e-10,max_ratio=10.0):
     '''
     This function computes the normalization of all the the images (tomographic projections)
     of a stack, using a stack of dark images and one of flat images.
     It returns the new stack or normalized images.
-    The fuction used is the neutompy.normalize_proj(proj, dark, flat,  proj_180=None, out=None,
-    dose_file='', dose_coor=(), dose_draw=False,crop_file='', crop_coor=(), crop_draw=False,
-    scattering_bias=0.0, minus_log_lowest_val=None,min_denom=1.0e-9,  min_ratio=1e-10, max_ratio=10.0,
-    mode='mean', log=True,  sino_order=False, show_opt='mean'),
-    where the dose ROI and the crop ROI are not considered.
+    The normalization is the same of neutompy.normalize_proj() with log=True,
+    where the dose ROI and the crop ROI are not considered: the dark and flat images
+    are averaged and each image I is replaced by -log((I-D)/(F-D)), where F-D is
+    at least min_denom and the ratio is clamped between min_ratio and max_ratio.
+    The images are normalized chunk_size at a time (see normalize_slices()) by a pool
+    of workers threads, so no temporary full-size array is created.
+    The dark and flat images can be given as a single 2D image or as a view
+    of the same image repeated (see reference_stack()), in this case they
+    are not expanded to the dimensions of the stack of projections.
+    If in_place is True and the images are float32, the result is written in
+    img_stack itself. Otherwise a new float32 stack is allocated, in a
+    memory-mapped file if scratch_dir is given (see preparation_data.allocate_stack()).
 
     Parameters
     ----------
     img_stack : ndarray
         3D array containing the projection images
     dark_stack : ndarray
-        3D array containing the dark images
+        3D array containing the dark images (or 2D array of a single dark image)
     flat_stack : ndarray
-        3D array containing the flat images
+        3D array containing the flat images (or 2D array of a single flat image)
+    scratch_dir : str, optional
+        directory of the memory-mapped file where the normalized stack is stored.
+        Default is None (stack in memory)
+    chunk_size : int, optional
+        number of images normalized by a thread at a time. Default value is 16
+    workers : int, optional
+        number of threads used for the normalization. Default value is 1
+    in_place : bool, optional
+        whether to write the result in img_stack, if it is a writeable float32 array.
+        Default value is False
+    min_denom : float, optional
+        minimum value of the denominator F-D. Default value is 1.0e-9
+    min_ratio : float, optional
+        minimum value of the ratio (I-D)/(F-D). Default value is 1.0e-10
+    max_ratio : float, optional
+        maximum value of the ratio (I-D)/(F-D). Default value is 10.0
 
     Returns
     -------
     img_stack_norm : ndarray
-        3D array containing the normalized images
+        3D array (float32) containing the normalized images
 
     Raises
     ------
     ValueError
         if img_stack, dark_stack and flat_stack have different dimensions
+    ValueError
+        if workers or chunk_size is lower than 1
     '''
-    if img_stack.shape == dark_stack.shape and img_stack.shape == flat_stack.shape:
-        img_stack_norm = ntp.normalize_proj(img_stack,dark_stack,flat_stack,dose_draw=False,crop_draw=False,min_denom=0.000000001,min_ratio=0.0000000001,log=True)
+    if workers < 1 or chunk_size < 1:
+        raise ValueError('workers and chunk_size must be greater than zero')
+    dark_stack = reference_stack(dark_stack)
+    flat_stack = reference_stack(flat_stack)
+    if (img_stack.shape[1:] == dark_stack.shape[1:] and img_stack.shape[1:] == flat_stack.shape[1:]
+            and dark_stack.shape[0] in (1, img_stack.shape[0]) and flat_stack.shape[0] in (1, img_stack.shape[0])):
+        print('> Normalization...')
+        #mean dark and flat images and clamped denominator, computed once for all the images
+        dark = np.mean(dark_stack, axis=0).astype(np.float32)
+        den = np.mean(flat_stack, axis=0).astype(np.float32) - dark
+        den[den < np.float32(min_denom)] = np.float32(min_denom)
+
+        if in_place and img_stack.dtype == np.float32 and img_stack.flags.writeable:
+            img_stack_norm = img_stack
+        else:
+            img_stack_norm = preparation_data.allocate_stack(img_stack.shape, np.float32, scratch_dir)
+
+        nimages = img_stack.shape[0]
+        chunks = [(start, min(start + chunk_size, nimages)) for start in range(0, nimages, chunk_size)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(normalize_slices,img_stack,img_stack_norm,start,stop,dark,den,np.float32(min_ratio),np.float32(max_ratio)) for start, stop in chunks]
+            for future in futures:
+                future.result()
         return img_stack_norm
     else:
         raise ValueError('the stack of images (tomographic projections,flat images and dark images) must have the same dimensions')
 
-def outliers_filter (img_stack, radius_2D_neighborhood, axis=0, k=1.0):
+def outliers_type ():
+    '''
+    This function asks the user to choose the type of outliers to remove
+    (bright, dark or both) and returns it.
+
+    Returns
+    -------
+    outliers : str
+        'bright', 'dark' or 'both'
+
+    Raises
+    ------
+    OSError
+        if the user input is different from 'b','B','d','D','a' or 'A'
+    '''
+    ans = input('> Do you want to perform a filtering from bright outliers,dark outliers or both?\
+     \n[B] filter just bright outliers\
+     \n[D] filter just dark outliers\
+     \n[A] filter both bright and dark outliers\
+     \nType your answer and press [Enter] :')
+    if ans == 'B' or ans == 'b':
+        return 'bright'
+    elif ans == 'D' or ans == 'd':
+        return 'dark'
+    elif ans == 'A' or ans == 'a':
+        return 'both'
+    else:
+        raise OSError('Input not valid.')
+
+
+def median_image (img, radius_2D_neighborhood, median='exact'):
+    '''
+    This function returns the median filtered image used by the outliers filter.
+    With median='exact' the median of the 2D neighborhood is computed by
+    SimpleITK, with a cost that grows with the area of the neighborhood.
+    With median='separable' the median is approximated by a median along the rows
+    followed by a median along the columns (scipy.ndimage.median_filter()), with a
+    cost that grows just with the radius: isolated outliers are removed in the
+    same way, so it is suggested for large radii.
+
+    Parameters
+    ----------
+    img : ndarray
+        2D array containing the image
+    radius_2D_neighborhood : int or tuple of int
+        The radius of the 2D neighborhood, as (radius along x, radius along y) if it is a tuple
+    median : str, optional
+        The median used: 'exact' or 'separable'. Default value is 'exact'
+
+    Returns
+    -------
+    img_median : ndarray
+        2D array containing the median filtered image
+    '''
+    #SimpleITK and scipy are imported only when needed, since they slow down the start of the program
+    if median == 'exact':
+        import SimpleITK as sitk
+        median_filter = sitk.MedianImageFilter()
+        median_filter.SetRadius(radius_2D_neighborhood)
+        return sitk.GetArrayFromImage(median_filter.Execute(sitk.GetImageFromArray(img)))
+
+    rx, ry = (radius_2D_neighborhood, radius_2D_neighborhood) if np.isscalar(radius_2D_neighborhood) else radius_2D_neighborhood
+    from scipy import ndimage
+    img_median = ndimage.median_filter(img, size=(1, 2*rx + 1), mode='nearest')
+    return ndimage.median_filter(img_median, size=(2*ry + 1, 1), mode='nearest')
+
+
+def remove_outliers_slices (img_stack,start,stop,radius_2D_neighborhood,cut,outliers,median='exact'):
+    '''
+    This function removes in place the outliers from the images of the stack
+    with index from start to stop (excluded). The median image of each image is
+    computed once (see median_image()) and a pixel is replaced by the median if it deviates from it by
+    more than cut: towards higher values for bright outliers, towards lower values
+    for dark outliers and in both directions for both, in a single pass.
+
+    Parameters
+    ----------
+    img_stack : ndarray
+        3D array containing the images to filter
+    start : int
+        index of the first image to filter
+    stop : int
+        index after the last image to filter
+    radius_2D_neighborhood : int or tuple of int
+        The radius of the 2D neighborhood of the median filter
+    cut : float
+        maximum deviation from the median of the pixels which are not outliers
+    outliers : str
+        The type of outliers to remove: 'bright', 'dark' or 'both'
+    median : str, optional
+        The median used: 'exact' or 'separable'. Default value is 'exact'
+
+    Returns
+    -------
+    n : int
+        number of filtered images
+    '''
+    for s in range(start, stop):
+        img = img_stack[s]
+        img_median = median_image(img, radius_2D_neighborhood, median)
+        if outliers == 'bright':
+            spot = img - img_median > cut
+        elif outliers == 'dark':
+            spot = img_median - img > cut
+        else:
+            spot = np.abs(img - img_median) > cut
+        np.copyto(img, img_median, where=spot)
+    return stop - start
+
+
+def outliers_filter (img_stack, radius_2D_neighborhood, axis=0, k=1.0, outliers=None, threshold=0.02, median='exact', workers=1, chunk_size=8):
     '''
     This function removes bright or dark or both outliers from a stack of images.
     The algorithm elaborates 2d images and the filtering is iterated over all
-    images in the stack.
-    The function used is neutompy.remove_outliers_stack() and it replaces a pixel
-    by the median of the pixels in the 2d neighborhood
-    if it deviates from the median by more than a certain value (k*threshold).
-    Threshold is set to 0.02, while k is an optional parameter.
-    The user will be asked to choose the type of outliers to remove before the
-    filtering.
+    images in the stack, which are filtered in place.
+    As neutompy.remove_outliers_stack(), it replaces a pixel by the median of the
+    pixels in the 2d neighborhood if it deviates from the median by more than
+    a certain value (k*threshold), where the global threshold and k are optional parameters.
+    The median of each image is computed just once, also when both bright and
+    dark outliers are removed (see remove_outliers_slices()), and the images are
+    filtered in chunks of chunk_size images distributed among a pool of workers threads.
+    If the type of outliers is not given, the user will be asked to choose
+    it before the filtering (see outliers_type()): the type must be given when the
+    filter runs without a user, e.g. in batch or streaming pipelines.
 
     Parameters
     ----------
@@ -129,6 +413,18 @@ def outliers_filter (img_stack, radius_2D_neighborhood, axis=0, k=1.0):
         A pixel is replaced by the median of the pixels in the neighborhood
         if it deviates from the median by more than k*threshold.
         Default value is 1.0.
+    outliers : str, optional
+        The type of outliers to remove: 'bright', 'dark' or 'both'.
+        Default is None (the user is asked to choose it)
+    threshold : float, optional
+        The global threshold of the deviation from the median. Default value is 0.02
+    median : str, optional
+        The median used: 'exact' or 'separable' (faster for large radii, see median_image()).
+        Default value is 'exact'
+    workers : int, optional
+        number of threads used for the filtering. Default value is 1
+    chunk_size : int, optional
+        number of images filtered by a thread at a time. Default value is 8
 
     Returns
     -------
@@ -139,26 +435,254 @@ def outliers_filter (img_stack, radius_2D_neighborhood, axis=0, k=1.0):
     ------
     OSError
         if the user input is different from 'b','B','d','D','a' or 'A'
+    ValueError
+        if outliers is different from 'bright', 'dark' or 'both'
+    ValueError
+        if threshold or k is negative
+    ValueError
+        if median is different from 'exact' or 'separable'
+    ValueError
+        if workers or chunk_size is lower than 1
     '''
-    ans = input('> Do you want to perform a filtering from bright outliers,dark outliers or both?\
-     \n[B] filter just bright outliers\
-     \n[D] filter just dark outliers\
-     \n[A] filter both bright and dark outliers\
-     \nType your answer and press [Enter] :')
-    if ans == 'B' or ans == 'b':
-        img_stack_filtered = ntp.remove_outliers_stack(img_stack,radius_2D_neighborhood,threshold=0.02,axis=axis,k=k,outliers='bright')
-    elif ans == 'D' or ans == 'd':
-        img_stack_filtered = ntp.remove_outliers_stack(img_stack,radius_2D_neighborhood,threshold=0.02,axis=axis,k=k,outliers='dark')
-    elif ans == 'A' or ans == 'a':
-        img_stack_filtered = ntp.remove_outliers_stack(img_stack,radius_2D_neighborhood,threshold=0.02,axis=axis,k=k,outliers='bright')
-        img_stack_filtered = ntp.remove_outliers_stack(img_stack,radius_2D_neighborhood,threshold=0.02,axis=axis,k=k,outliers='dark')
-    else:
-        raise OSError('Input not valid.')
+    if threshold < 0 or k < 0:
+        raise ValueError('threshold and k must not be negative')
+    if median not in ('exact', 'separable'):
+        raise ValueError('the median must be exact or separable')
+    if outliers is None:
+        outliers = outliers_type()
+    if outliers not in ('bright', 'dark', 'both'):
+        raise ValueError('the type of outliers must be bright, dark or both')
+    if workers < 1 or chunk_size < 1:
+        raise ValueError('workers and chunk_size must be greater than zero')
+
+    img_stack_filtered = img_stack.swapaxes(0, axis)
+    cut = np.array(threshold*k, dtype=img_stack.dtype)      #same comparison of neutompy
+    nimages = img_stack_filtered.shape[0]
+    chunks = [(start, min(start + chunk_size, nimages)) for start in range(0, nimages, chunk_size)]
+
+    print('> Removing ' + outliers + ' outliers...')
+    with tqdm(total=nimages, unit=' images') as progress:
+        if workers == 1:
+            for start, stop in chunks:
+                progress.update(remove_outliers_slices(img_stack_filtered,start,stop,radius_2D_neighborhood,cut,outliers,median))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(remove_outliers_slices,img_stack_filtered,start,stop,radius_2D_neighborhood,cut,outliers,median) for start, stop in chunks]
+                for future in as_completed(futures):
+                    progress.update(future.result())
+
+    return img_stack_filtered.swapaxes(0, axis)
     
-    return img_stack_filtered
+
+def rows_for_correction (row_ranges,ystep=5):
+    '''
+    This function returns the y coordinates of the rows used to estimate the
+    axis of rotation (see find_shift_and_tilt_angle()), taking the rows of each
+    range from ymin to ymax (included) with a step defined by ystep.
+
+    Parameters
+    ----------
+    row_ranges : list
+        list of tuples (ymin,ymax), one for each region where the sample is visible
+    ystep : int, optional
+        the step between two successive y coordinates in the returned array.
+        Default value is 5
+
+    Returns
+    -------
+    y_of_ROIs : ndarray
+        1D array containing the y coordinates included in the ranges
+
+    Raises
+    ------
+    ValueError
+        if ystep is lower than 1 or ymin>ymax in a range
+    '''
+    if ystep < 1:
+        raise ValueError('ystep must be greater than zero')
+    #array containing the y points within the ranges
+    y_of_ROIs = np.array([], dtype=np.int32)
+    for ymin, ymax in row_ranges:
+        if ymin > ymax:
+            raise ValueError('ymin must be less than ymax in every range of rows')
+        y_of_ROIs = np.concatenate((y_of_ROIs, np.arange(ymin, ymax + 1, ystep)), axis=0)
+    return y_of_ROIs
+
+
+def sse_curves_direct (rows_0,rows_180_flip):
+    '''
+    This function computes, for each row, the mean squared error between
+    the row of the projection at 0° circularly shifted by t pixels and the
+    corresponding row of the flipped projection at 180°, for every shift t.
+    The shifts are evaluated one at a time with np.roll, but all the rows
+    are processed together.
+
+    Parameters
+    ----------
+    rows_0 : ndarray
+        2D array containing the selected rows of the projection at 0°
+    rows_180_flip : ndarray
+        2D array containing the same rows of the horizontally flipped projection at 180°
+
+    Returns
+    -------
+    sse : ndarray
+        2D array (rows x nx) where sse[i,t] is the error of the row i for the shift t (modulo nx)
+    '''
+    nx = rows_0.shape[1]
+    sse = np.empty(rows_0.shape, dtype=np.float64)
+    for t in range(nx):
+        sse[:,t] = np.square(np.roll(rows_0, t, axis=1) - rows_180_flip).sum(axis=1) / nx
+    return sse
+
+
+def sse_curves_fft (rows_0,rows_180_flip):
+    '''
+    This function computes the same mean squared error curves of sse_curves_direct(),
+    but through the cross-correlation computed in the Fourier space:
+    SSE(t) = ||a||^2 + ||b||^2 - 2*xcorr(t),
+    where a is the row of the projection at 0° and b the row of the flipped
+    projection at 180°. All the rows are transformed together with a single
+    FFT along the x axis, hence the cost is O(rows * nx*log(nx)) instead of O(rows * nx^2).
+
+    Parameters
+    ----------
+    rows_0 : ndarray
+        2D array containing the selected rows of the projection at 0°
+    rows_180_flip : ndarray
+        2D array containing the same rows of the horizontally flipped projection at 180°
+
+    Returns
+    -------
+    sse : ndarray
+        2D array (rows x nx) where sse[i,t] is the error of the row i for the shift t (modulo nx)
+    '''
+    nx = rows_0.shape[1]
+    a = rows_0.astype(np.float64)
+    b = rows_180_flip.astype(np.float64)
+
+    # circular cross-correlation: xcorr[t] = sum_i a[i-t]*b[i]
+    xcorr = np.fft.irfft(np.conj(np.fft.rfft(a, axis=1)) * np.fft.rfft(b, axis=1), n=nx, axis=1)
+
+    norms = np.square(a).sum(axis=1) + np.square(b).sum(axis=1)
+    sse = (norms[:,np.newaxis] - 2*xcorr) / nx
+    return sse
+
+
+def sse_curves_pyramid (rows_0,rows_180_flip,downsampling=4,window=3):
+    '''
+    This function computes the same mean squared error curves of sse_curves_direct(),
+    but just for the shifts close to the minimum, following a coarse-to-fine search.
+    Firstly the rows are downsampled along x (averaging groups of downsampling pixels)
+    and the shift minimizing the sum of the errors of all the rows is found.
+    Then, at full resolution, each row is compared just for the shifts in a narrow window
+    centred on the result of the previous row (or on the coarse shift for the first row).
+    If the minimum falls on the edge of the window, the window is doubled until the
+    minimum is inside it, so the two neighbours of the minimum are always computed.
+    The errors of the shifts outside the windows are set to infinity.
+
+    Parameters
+    ----------
+    rows_0 : ndarray
+        2D array containing the selected rows of the projection at 0°
+    rows_180_flip : ndarray
+        2D array containing the same rows of the horizontally flipped projection at 180°
+    downsampling : int, optional
+        the downsampling factor along x for the coarse search. Default value is 4
+    window : int, optional
+        the half width (in px) of the window of shifts searched for each row.
+        Default value is 3
+
+    Returns
+    -------
+    sse : ndarray
+        2D array (rows x nx) where sse[i,t] is the error of the row i for the shift t (modulo nx)
     
+    Raises
+    ------
+    ValueError
+        if downsampling or window is lower than 1
+    '''
+    if downsampling < 1 or window < 1:
+        raise ValueError('downsampling and window must be greater than zero')
+
+    nrows, nx = rows_0.shape
+    sse = np.full(rows_0.shape, np.inf)
+
+    # coarse search on the downsampled rows
+    nxc = nx // downsampling
+    if nxc > 1:
+        bins_0 = rows_0[:, :nxc*downsampling].reshape(nrows, nxc, downsampling).mean(axis=2)
+        bins_180 = rows_180_flip[:, :nxc*downsampling].reshape(nrows, nxc, downsampling).mean(axis=2)
+        sse_coarse = sse_curves_fft(bins_0,bins_180).sum(axis=0)
+        tc = np.argmin(sse_coarse)
+        if tc > nxc//2:
+            tc = tc - nxc
+        center = tc*downsampling
+        half_width = window + downsampling
+    else:
+        center = 0
+        half_width = nx//2
 
-def find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180):
+    # fine search, each row is seeded with the result of the previous one
+    for i in range(nrows):
+        a = rows_0[i]
+        b = rows_180_flip[i]
+        t_lo, t_hi = center - half_width, center + half_width
+        computed = set()
+        while True:
+            for t in range(t_lo, t_hi + 1):
+                if t % nx not in computed:
+                    sse[i, t % nx] = np.square(np.roll(a, t) - b).sum() / nx
+                    computed.add(t % nx)
+            t_min = t_lo + np.argmin(sse[i, np.arange(t_lo, t_hi + 1) % nx])
+            if (t_lo < t_min < t_hi) or len(computed) == nx:
+                break
+            half_width = 2*half_width
+            t_lo, t_hi = t_min - half_width, t_min + half_width
+        center = t_min
+        half_width = window
+
+    return sse
+
+
+def parabolic_refinement (sse,shift):
+    '''
+    This function refines to a sub-pixel precision the integer shifts that minimize
+    the error curves, fitting a parabola through the minimum and its two
+    neighbours and returning the position of its vertex.
+    The curves are periodic, hence the neighbours are taken modulo nx.
+
+    Parameters
+    ----------
+    sse : ndarray
+        2D array (rows x nx) where sse[i,t] is the error of the row i for the shift t (modulo nx)
+    shift : ndarray
+        1D array containing the integer shift that minimizes the error for each row
+
+    Returns
+    -------
+    shift_sub : ndarray
+        1D array containing the fractional shift for each row
+    '''
+    nx = sse.shape[1]
+    rows = np.arange(sse.shape[0])
+    t = shift.astype(np.int64)
+
+    s_prev = sse[rows, (t - 1) % nx]
+    s_0    = sse[rows, t % nx]
+    s_next = sse[rows, (t + 1) % nx]
+
+    den = s_prev - 2*s_0 + s_next
+    delta = np.zeros(t.size)
+    curved = den > 0       #the vertex is a minimum only if the parabola is convex
+    delta[curved] = 0.5*(s_prev[curved] - s_next[curved]) / den[curved]
+    delta = np.clip(delta, -0.5, 0.5)
+
+    return t + delta
+
+
+def find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180,method='direct',subpixel=False,downsampling=4,window=3):
     '''
     This function estimates the offset and the tilt angle of the rotation axis with 
     respect to the detector using the projections at 0° and at 180°.
@@ -168,6 +692,13 @@ def find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180):
     Hence the shift estimates for each y position are used to compute a polynomial 
     fit of degree 1, obtaining the shift and the tilt angle of the axis of rotation.
     Some algebrical operations are performed on these final values for costruction.
+    The errors can be computed directly, shifting the rows one pixel at a time,
+    or through the cross-correlation in the Fourier space (see sse_curves_fft()),
+    which is much faster for wide images, or with a coarse-to-fine search that computes
+    the errors just for the shifts close to the minimum (see sse_curves_pyramid()).
+    If subpixel is True, the shift of each row is refined with a parabolic fit
+    around the minimum of the error (see parabolic_refinement()), and the offset
+    is not rounded to an integer number of pixels.
 
     References:
     [1] M. Yang, H. Gao, X. Li, F. Meng, D. Wei, "A new method todetermine the center
@@ -186,6 +717,18 @@ def find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180):
         2D array of the tomographic projection at 0°
     proj_180 : ndarray
         2D array of the tomographic projection at 180°
+    method : str, optional
+        the method used to compute the errors for all the shifts: 'direct', 'fft' or 'pyramid'.
+        Default value is 'direct'
+    subpixel : bool, optional
+        if True, the shifts are estimated with a sub-pixel precision.
+        Default value is False
+    downsampling : int, optional
+        the downsampling factor along x for the coarse search of the 'pyramid' method.
+        Default value is 4
+    window : int, optional
+        the half width (in px) of the window of shifts searched for each row in the 'pyramid' method.
+        Default value is 3
     
     Returns
     -------
@@ -197,8 +740,8 @@ def find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180):
         1D array containing the shift estimate for each y coordinate of y_of_ROIs
     offset : float
         shift of the axis of rotation with respect to the central vertical axis of the images
-    middle_shift : int
-        the offset value converted to integer
+    middle_shift : int or float
+        the offset value converted to integer (or the fractional offset if subpixel is True)
     theta : float
         the tilt angle of the rotation axis with respect to the central vertical axis of the images (in degrees) 
     
@@ -207,10 +750,14 @@ def find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180):
     ValueError
         when the number of elements in y_of_ROIs is equal to 1, that is when the selected ROI
         has null height.
+    ValueError
+        when method is different from 'direct', 'fft' or 'pyramid'
     '''
 
     if y_of_ROIs.size == 1:
         raise ValueError('ROI height must be greater than zero')
+    elif method not in ('direct','fft','pyramid'):
+        raise ValueError('the method for the shift search must be direct, fft or pyramid')
     else:
     
         tmin = - proj_0.shape[1]//2
@@ -219,25 +766,27 @@ def find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180):
         ny = proj_0.shape[0]
         nx = proj_0.shape[1]
 
-        shift = np.zeros(y_of_ROIs.size)
         proj_180_flip = proj_180[:, ::-1]
 
-        for y, slc in enumerate(y_of_ROIs):
-
-            minimum = 1e7
-            index_min = 0
-
-		     # loop over the shift
-            for t in range(tmin, tmax + 1):
+        posy = np.round(y_of_ROIs).astype(np.int32)
+        rows_0 = proj_0[posy]
+        rows_180_flip = proj_180_flip[posy]
 
-                posy = np.round(slc).astype(np.int32)
-                rmse = np.square( (np.roll(proj_0[posy], t, axis = 0) - proj_180_flip[posy]) ).sum() / nx
+        if method == 'fft':
+            sse = sse_curves_fft(rows_0,rows_180_flip)
+        elif method == 'pyramid':
+            sse = sse_curves_pyramid(rows_0,rows_180_flip,downsampling,window)
+        else:
+            sse = sse_curves_direct(rows_0,rows_180_flip)
 
-                if(rmse <= minimum):
-                    minimum = rmse
-                    index_min = t
+        # errors ordered from tmin to tmax: in case of equal errors the last shift is kept
+        t_range = np.arange(tmin, tmax + 1)
+        sse_range = sse[:, t_range % nx]
+        index_min = t_range.size - 1 - np.argmin(sse_range[:, ::-1], axis=1)
+        shift = t_range[index_min].astype(np.float64)
 
-            shift[y] = index_min
+        if subpixel:
+            shift = parabolic_refinement(sse,shift)
     
 
 	    # perform linear fit
@@ -256,8 +805,12 @@ def find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180):
         theta = np.rad2deg(theta)
 
 	    # compute the shift
-        offset       = (np.round(m*ny*0.5 + q)).astype(np.int32)*0.5
-        middle_shift = (np.round(m*ny*0.5 + q)).astype(np.int32)//2
+        if subpixel:
+            offset       = (m*ny*0.5 + q)*0.5
+            middle_shift = offset
+        else:
+            offset       = (np.round(m*ny*0.5 + q)).astype(np.int32)*0.5
+            middle_shift = (np.round(m*ny*0.5 + q)).astype(np.int32)//2
 
 
         print("Rotation axis Found!")
@@ -266,49 +819,577 @@ def find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180):
         return m,q,shift,offset,middle_shift, theta
 
 
-def correction_axis_rotation (img_stack,shift,theta,datapath):
+def rotate_and_shift (img,theta,shift,interpolator=None):
+    '''
+    This function rotates an image by theta around its centre and shifts it
+    horizontally by shift pixels with a single resample (one affine transform),
+    instead of a rotation followed by np.roll.
+    The pixels entering from the edges take the value of the nearest pixel
+    of the image, so no wrap-around occurs.
+
+    Parameters
+    ----------
+    img : ndarray
+        2D array representing the image to correct
+    theta : float
+        the rotation angle (in degrees)
+    shift : int or float
+        horizontal shift (in px)
+    interpolator : int, optional
+        the SimpleITK interpolator. Default is None (sitk.sitkLinear)
+
+    Returns
+    -------
+    img_corrected : ndarray
+        2D array representing the rotated and shifted image
+    '''
+    import SimpleITK as sitk        #imported only when needed, since it slows down the start of the program
+    if interpolator is None:
+        interpolator = sitk.sitkLinear
+    s = sitk.GetImageFromArray(img)
+
+    th = -np.deg2rad(theta)
+    matrix = np.array([[np.cos(th), np.sin(th)], [-np.sin(th), np.cos(th)]])
+    center = (np.array(img.shape)*0.5 - 0.5)[::-1]        #(x,y) coordinates of the centre of the image
+    # the shift is applied after the rotation: out(p) = img(matrix*(p - shift - center) + center)
+    translation = -np.dot(matrix, np.array([shift, 0.0]))
+
+    affine = sitk.AffineTransform(2)
+    affine.SetMatrix(matrix.flatten().tolist())
+    affine.SetCenter(center.tolist())
+    affine.SetTranslation(translation.tolist())
+
+    out = sitk.Resample(s, s, affine, interpolator, 0.0, sitk.sitkUnknown, True)
+    return sitk.GetArrayFromImage(out)
+
+
+def residual (proj_0,proj_180,shift,theta):
+    '''
+    This function corrects the projections at 0° and 180° according to the shift
+    and the tilt angle of the axis of rotation (see rotate_and_shift()) and returns
+    the mean absolute difference between the projection at 0° and the flipped one
+    at 180°, that is low when the axis of rotation is well estimated.
+
+    Parameters
+    ----------
+    proj_0 : ndarray
+        2D array of the tomographic projection at 0°
+    proj_180 : ndarray
+        2D array of the tomographic projection at 180°
+    shift : int or float
+        shift of the axis of rotation with respect to the central vertical axis of the images (in px)
+    theta : float
+        the tilt angle of the rotation axis with respect to the central vertical axis of the images (in degrees)
+
+    Returns
+    -------
+    res : float
+        mean absolute difference between the corrected projection at 0° and the flipped corrected projection at 180°
+    '''
+    p0_r = rotate_and_shift(proj_0, theta, shift)
+    p180_r = rotate_and_shift(proj_180, theta, shift)
+    return float(np.abs(p0_r - p180_r[:,::-1]).mean())
+
+
+def correct_slices (img_stack,start,stop,shift,theta):
+    '''
+    This function corrects in place the images of the stack with index
+    from start to stop (excluded), rotating them by theta and shifting them by shift
+    with a single resample (see rotate_and_shift()).
+
+    Parameters
+    ----------
+    img_stack : ndarray
+        3D array containing the tomographic projection images to correct
+    start : int
+        index of the first image to correct
+    stop : int
+        index after the last image to correct
+    shift : int or float
+        shift of the axis of rotation with respect to the central vertical axis of the images (in px)
+    theta : float
+        the tilt angle of the rotation axis with respect to the central vertical axis of the images (in degrees)
+
+    Returns
+    -------
+    n : int
+        number of corrected images
+    '''
+    for s in range(start, stop):
+        img_stack[s,:,:] = rotate_and_shift(img_stack[s,:,:], theta, shift)
+    return stop - start
+
+
+def missing_chunks (nimages,chunk_size,writer=None):
+    '''
+    This function divides the images not yet saved by the writer (all the images
+    if writer is None) in chunks of consecutive images, with at most chunk_size images each.
+
+    Parameters
+    ----------
+    nimages : int
+        number of images
+    chunk_size : int
+        maximum number of images of a chunk
+    writer : ImageWriter, optional
+        the writer saving the images (see ImageWriter.is_saved()). Default is None
+
+    Returns
+    -------
+    chunks : list
+        list of tuples (start,stop) with the index of the first image of each chunk
+        and the index after the last one
+    '''
+    chunks = []
+    start = None
+    for i in range(nimages + 1):
+        missing = i < nimages and (writer is None or not writer.is_saved(i))
+        if start is not None and (not missing or i - start == chunk_size):
+            chunks.append((start, i))
+            start = None
+        if missing and start is None:
+            start = i
+    return chunks
+
+
+def correction_axis_rotation (img_stack,shift,theta,datapath,workers=1,chunk_size=8,show=True,writer=None):
     '''
     This function performs the correction of all the images in the stack,
     according to the shift and tilt angle of the axis of rotation
     with respect to the central vertical axis of the images.
-    The method also open the file data.txt placed in the path expressed by 
-    datapath and write there the values of the shift and the tilt angle of
-    the axis of rotation.
+    The images are corrected in place, in chunks of chunk_size images
+    distributed among a pool of workers threads (SimpleITK releases the GIL
+    during the resampling, so the chunks are corrected in parallel).
+    If a writer is given (see ImageWriter), the images of each chunk are saved
+    as soon as the chunk is corrected, while the other chunks are still being corrected;
+    the images already saved by a previous run (when the writer resumes it) are not
+    corrected again, so they are left as they are in the returned stack.
+    If show is True, the corrected stack is shown (see show_stack.plot_tracker()).
+    The method also saves the values of the shift and the tilt angle of
+    the axis of rotation in the file results.json placed in the path expressed by
+    datapath (see save_axis()).
     Finally it returns the stack of corrected images.
 
     Parameters
     ----------
     img_stack : ndarray
         3D array containing the tomographic projection images to correct
-    shift : int
-        shift of the axis of rotation with respect to the central vertical axis of the images (in px)
+    shift : int or float
+        shift of the axis of rotation with respect to the central vertical axis of the images (in px).
+        It can be fractional, since rotation and shift are applied with a single interpolation (see rotate_and_shift())
     theta : float
         the tilt angle of the rotation axis with respect to the central vertical axis of the images (in degrees)
     datapath : str
-        string representing the directory path where data.txt is placed
+        string representing the directory path where results.json is placed
+    workers : int, optional
+        number of threads used for the correction. Default value is 1
+    chunk_size : int, optional
+        number of images corrected by a thread at a time. Default value is 8
+    show : bool, optional
+        whether to show the corrected stack. If False, no graphical module is imported.
+        Default value is True
+    writer : ImageWriter, optional
+        the writer saving the corrected images. Default is None (the images are not saved)
     
     Returns
     -------
     img_stack : ndarray
         3D array containing the corrected tomographic images
+
+    Raises
+    ------
+    ValueError
+        if workers or chunk_size is lower than 1
     '''
+    if workers < 1 or chunk_size < 1:
+        raise ValueError('workers and chunk_size must be greater than zero')
     
     print('> Correcting rotation axis misalignment...')
-    for s in tqdm(range(0, img_stack.shape[0]), unit=' images'):
-        img_stack[s,:,:] = np.roll(rotate_sitk(img_stack[s,:,:], theta, interpolator=sitk.sitkLinear), shift, axis=1)
-    
-    show_stack.plot_tracker(img_stack)
-    print('>Writing shift and theta values in data.txt file...')
+    chunks = missing_chunks(img_stack.shape[0],chunk_size,writer)
 
-    with open(os.path.join(datapath,'data.txt'),'a') as file:
-        file.write('\nshift {0} \ntilt angle {1}'.format(shift,theta))
+    with tqdm(total=sum(stop - start for start, stop in chunks), unit=' images') as progress:
+        if workers == 1:
+            for start, stop in chunks:
+                progress.update(correct_slices(img_stack,start,stop,shift,theta))
+                if writer is not None:
+                    for i in range(start, stop):
+                        writer.submit(i,img_stack[i])
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(correct_slices,img_stack,start,stop,shift,theta): (start, stop) for start, stop in chunks}
+                for future in as_completed(futures):
+                    progress.update(future.result())
+                    if writer is not None:
+                        for i in range(*futures[future]):
+                            writer.submit(i,img_stack[i])
+    
+    if show:
+        import show_stack       #graphical module imported only when needed
+        show_stack.plot_tracker(img_stack)
+    save_axis(shift,theta,datapath)
 
     return img_stack
 
-def save_images (new_fname,img_stack,digits):
+def correction_stream (files,shift,theta,datapath,new_fname,digits,roi=None,dark=None,flat=None,radius_2D_neighborhood=None,outliers='both',threshold=0.02,k=1.0,median='exact',chunk_size=64,workers=1,writer=None):
+    '''
+    This function corrects the tomographic projections listed in files without
+    keeping the whole stack in memory: the projections are processed in chunks of
+    chunk_size images, and each chunk is read (just the ROI, if given), normalized,
+    filtered from outliers, corrected and saved before the next one is read.
+    The corrected images are saved as the ones of save_images(), with the index
+    of the projection in the list files, by a pool of threads (see ImageWriter)
+    while the following chunk is read and corrected. When the writer resumes a
+    previous run, just the projections not yet saved are read and corrected.
+    Finally the method writes the values of the shift and the tilt angle of the
+    axis of rotation in the file results.json placed in the path expressed by datapath.
+
+    Parameters
+    ----------
+    files : list
+        list of strings representing the paths of the .tiff projections, in order of acquisition
+    shift : int or float
+        shift of the axis of rotation with respect to the central vertical axis of the images (in px)
+    theta : float
+        the tilt angle of the rotation axis with respect to the central vertical axis of the images (in degrees)
+    datapath : str
+        string representing the directory path where results.json is placed
+    new_fname : str
+        string representing the new files (.tiff images) path and the prefix of their name
+    digits : int
+        number of digits used for the numbering of the images
+    roi : tuple, optional
+        coordinates (rowmin,rowmax,colmin,colmax) of the ROI used to crop the images.
+        Default is None (no cropping)
+    dark : ndarray, optional
+        2D array of the dark image (not cropped) used for the normalization.
+        Default is None (no normalization)
+    flat : ndarray, optional
+        2D array of the flat image (not cropped) used for the normalization.
+        Default is None (no normalization)
+    radius_2D_neighborhood : int or tuple of int, optional
+        The radius of the 2D neighborhood for the outliers filter (see outliers_filter()).
+        Default is None (no filtering)
+    outliers : str, optional
+        The type of outliers to remove: 'bright', 'dark' or 'both'. Default value is 'both'
+    threshold : float, optional
+        The global threshold of the outliers filter. Default value is 0.02
+    k : float, optional
+        The factor of the threshold of the outliers filter. Default value is 1.0
+    median : str, optional
+        The median used by the outliers filter: 'exact' or 'separable'. Default value is 'exact'
+    chunk_size : int, optional
+        number of projections kept in memory at a time. Default value is 64
+    workers : int, optional
+        number of threads used to read and correct the images of a chunk. Default value is 1
+    writer : ImageWriter, optional
+        the writer saving the corrected images.
+        Default is None (the images are saved by an ImageWriter with default options)
+
+    Raises
+    ------
+    ValueError
+        if workers or chunk_size is lower than 1
+    ValueError
+        if rowmin>rowmax or colmin>colmax
+    '''
+    if workers < 1 or chunk_size < 1:
+        raise ValueError('workers and chunk_size must be greater than zero')
+    if roi is not None:
+        rowmin,rowmax,colmin,colmax = roi
+        if rowmin > rowmax or colmin > colmax:
+            raise ValueError ('rowmin and colmin must be less than rowmax and colmax rispectively')
+    normalize = dark is not None and flat is not None
+    if normalize and roi is not None:
+        dark = dark[rowmin:rowmax,colmin:colmax]
+        flat = flat[rowmin:rowmax,colmin:colmax]
+
+    if writer is None:
+        writer = ImageWriter(new_fname,digits)
+
+    print('> Correcting rotation axis misalignment chunk by chunk...')
+    chunks = missing_chunks(len(files),chunk_size,writer)
+    with writer, ThreadPoolExecutor(max_workers=workers) as executor, tqdm(total=sum(stop - start for start, stop in chunks), unit=' images') as progress:
+        for start, stop in chunks:
+            chunk = preparation_data.read_images(files[start:stop],workers,roi=roi)     #just the ROI of the images is read
+            if normalize:
+                chunk = normalization(chunk,dark,flat,workers=workers,in_place=True)
+            if radius_2D_neighborhood is not None:
+                chunk = outliers_filter(chunk,radius_2D_neighborhood,k=k,outliers=outliers,threshold=threshold,median=median,workers=workers)
+
+            #the images of the chunk are divided among the threads
+            step = -(-chunk.shape[0] // workers)
+            futures = [executor.submit(correct_slices,chunk,i,min(i + step, chunk.shape[0]),shift,theta) for i in range(0, chunk.shape[0], step)]
+            for future in futures:
+                future.result()
+
+            #the corrected images are written while the next chunk is processed
+            for i in range(chunk.shape[0]):
+                writer.submit(start + i,chunk[i])
+            progress.update(stop - start)
+
+    save_axis(shift,theta,datapath)
+
+
+class ImageWriter:
+    '''
+    This class saves the corrected images as .tiff files from a pool of threads,
+    so the images are written while the following ones are still being corrected.
+    The images are saved as the ones of save_images(): new_fname followed by the
+    index of the image written with digits digits.
+    At most max_pending images wait to be written at a time: submit() blocks until
+    one of them is saved, so the memory used by the images waiting for the disk is bounded.
+    The images can be converted to float32 or rescaled to uint16 (the values from
+    value_range[0] to value_range[1] become the values from 0 to 65535) to reduce
+    the size of the files.
+    It is used as a context manager: when the block ends all the images are saved
+    and the first error raised while writing them, if any, is raised.
+    Each image is written in a temporary file which then replaces the final one, so
+    the .tiff files are always complete, and the indices of the saved images are
+    recorded in the checkpoint file new_fname + '_checkpoint.json' every max_pending
+    images and when an error stops the correction; the checkpoint is removed when
+    all the images are saved.
+    If resume is True, the images recorded in the checkpoint whose files exist with
+    the expected shape and type are not saved again (see is_saved()), while the
+    other files are overwritten: a run stopped while saving the images can be
+    restarted in the same folder, correcting just the missing projections.
+    The checkpoint records the settings of the writer, the shape of the images and
+    the description of their source (e.g. the checksums of the projections, the ROI,
+    the preprocessing, the shift and the tilt angle): if any of them changes, no
+    image of the previous run is kept. An image with a shape or a type different from
+    the ones of the saved images is never written, so the folder can not contain
+    a mix of images of different runs.
+
+    Parameters
+    ----------
+    new_fname : str
+        string representing the new files (.tiff images) path and the prefix of their name
+    digits : int
+        number of digits used for the numbering of the images
+    workers : int, optional
+        number of threads writing the images. Default value is 2
+    max_pending : int, optional
+        maximum number of images waiting to be written. Default value is 16
+    dtype : str, optional
+        type of the saved images: 'float32' or 'uint16'. Default is None (type of the images)
+    value_range : tuple, optional
+        (minimum,maximum) values rescaled to 0 and 65535 when dtype is 'uint16'.
+        Default is None
+    resume : bool, optional
+        whether to keep the images saved by a previous run (see above). Default is False
+    shape : tuple, optional
+        the shape of the images to save. Default is None (the shape of the first saved image)
+    source : dict, optional
+        the description of the images to save, which must be the same to resume a run.
+        Default is None
+
+    Raises
+    ------
+    ValueError
+        if workers or max_pending is lower than 1
+    ValueError
+        if dtype is different from None, 'float32' or 'uint16'
+    ValueError
+        if dtype is 'uint16' and value_range is not given or its minimum is not less than its maximum
+    '''
+    def __init__ (self,new_fname,digits,workers=2,max_pending=16,dtype=None,value_range=None,resume=False,shape=None,source=None):
+        if workers < 1 or max_pending < 1:
+            raise ValueError('workers and max_pending must be greater than zero')
+        if dtype not in (None, 'float32', 'uint16'):
+            raise ValueError('the type of the saved images must be float32 or uint16')
+        if dtype == 'uint16' and (value_range is None or value_range[0] >= value_range[1]):
+            raise ValueError('a range of values (minimum,maximum) with minimum less than maximum is required to save uint16 images')
+
+        self.new_fname = new_fname
+        self.digits = digits
+        self.dtype = dtype
+        self.value_range = value_range
+        self.resume = resume
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+        self.checkpoint = new_fname + '_checkpoint.json'
+        self.checkpoint_every = max_pending
+        self.lock = threading.Lock()
+        #the settings are compared with the ones read from the checkpoint, so they are converted as in a .json file
+        self.settings = json.loads(json.dumps(dict(digits=digits, dtype=dtype, value_range=value_range,
+                                                   shape=shape, source=source), default=record.to_json))
+        self.image_format = None        #shape and type of the saved files
+        self.saved = set()
+        self.unrecorded = 0             #images saved after the last checkpoint
+        if resume:
+            self.saved = self.verified_images()
+            if len(self.saved) > 0:
+                print('> {0} images already saved are not corrected again'.format(len(self.saved)))
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self,exc_type,exc_value,traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(wait=True)   #the error of the block is raised, not the ones of the writing
+            self.save_checkpoint()
+        return False
+
+    def filename (self,index):
+        '''
+        This method returns the name of the file of the image with the given index.
+        '''
+        return self.new_fname + '_' + str(index).zfill(self.digits) + '.tiff'
+
+    def is_saved (self,index):
+        '''
+        This method returns whether the image with the given index is already saved.
+        '''
+        return index in self.saved
+
+    def verify (self,index,shape,dtype):
+        '''
+        This method returns whether the file of the image with the given index
+        exists and contains an image with the given shape and type.
+        '''
+        try:
+            with tifffile.TiffFile(self.filename(index)) as tif:
+                page = tif.pages[0]
+                return list(page.shape) == shape and page.dtype.str == dtype
+        except Exception:                   #missing, incomplete or damaged file
+            return False
+
+    def verified_images (self):
+        '''
+        This method reads the checkpoint and returns the set of the indices of the
+        images recorded in it whose files are verified (see verify()). No image is
+        kept if the checkpoint was written with different settings (digits, dtype,
+        value_range, shape or source).
+        '''
+        checkpoint = record.read_json(self.checkpoint)
+        if not checkpoint:
+            return set()
+        shape, dtype = checkpoint['shape'], checkpoint['file_dtype']
+        if checkpoint['settings'] != self.settings or (self.settings['shape'] is not None and shape != self.settings['shape']):
+            print('> The images in {0} were saved with different settings: they are saved again'.format(self.checkpoint))
+            return set()
+        indices = checkpoint['saved']
+        valid = self.executor.map(lambda index: self.verify(index,shape,dtype), indices)
+        self.image_format = (shape, dtype)
+        return {index for index, ok in zip(indices, valid) if ok}
+
+    def save_checkpoint (self):
+        '''
+        This method writes the checkpoint with the indices of the saved images.
+        '''
+        with self.lock:
+            if self.image_format is None:
+                return
+            shape, dtype = self.image_format
+            record.write_json(self.checkpoint,dict(settings=self.settings, shape=shape, file_dtype=dtype, saved=sorted(self.saved)))
+            self.unrecorded = 0
+
+    def convert (self,img):
+        '''
+        This method returns the image converted to the type of the saved images.
+        '''
+        if self.dtype == 'uint16':
+            vmin, vmax = self.value_range
+            scaled = (img - vmin) * (65535.0 / (vmax - vmin))
+            np.clip(scaled, 0, 65535, out=scaled)
+            return np.rint(scaled, out=scaled).astype(np.uint16)
+        if self.dtype == 'float32':
+            return img.astype(np.float32, copy=False)
+        return img
+
+    def write (self,index,img):
+        '''
+        This method saves an image, in a thread of the pool.
+
+        Raises
+        ------
+        OSError
+            if the file of the image already exists and resume is False
+        ValueError
+            if the shape or the type of the image is different from the ones of the saved images
+        '''
+        try:
+            fname = self.filename(index)
+            if not self.resume and os.path.isfile(fname):
+                raise OSError('File already exists : {0}'.format(fname))
+            img = self.convert(img)
+            image_format = (list(img.shape), img.dtype.str)
+            with self.lock:
+                if self.image_format is None:
+                    self.image_format = image_format
+                elif self.image_format != image_format:
+                    raise ValueError('the image {0} has shape {1} and type {2}, while the saved images have shape {3} and type {4}'.format(
+                                     index, tuple(image_format[0]), image_format[1], tuple(self.image_format[0]), self.image_format[1]))
+            tmp_fname = fname + '.tmp'
+            tifffile.imwrite(tmp_fname, img)
+            os.replace(tmp_fname, fname)
+        finally:
+            self.slots.release()
+
+        with self.lock:
+            self.saved.add(index)
+            self.unrecorded += 1
+            write_checkpoint = self.unrecorded >= self.checkpoint_every
+        if write_checkpoint:
+            self.save_checkpoint()
+
+    def check (self):
+        '''
+        This method raises the first error raised while writing the images
+        saved so far, and forgets the images already saved.
+        '''
+        pending = []
+        for future in self.futures:
+            if future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def submit (self,index,img):
+        '''
+        This method adds an image to the ones to write, waiting if max_pending
+        images are already waiting to be written. The image must not be
+        modified until it is saved.
+
+        Parameters
+        ----------
+        index : int
+            index of the image in the name of the file
+        img : ndarray
+            2D array of the image
+        '''
+        self.check()
+        self.slots.acquire()
+        self.futures.append(self.executor.submit(self.write,index,img))
+
+    def close (self):
+        '''
+        This method waits until all the images are saved and raises the first
+        error raised while writing them. The checkpoint is removed if all the
+        images are saved, otherwise it is updated.
+        '''
+        self.executor.shutdown(wait=True)
+        futures, self.futures = self.futures, []
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            self.save_checkpoint()
+            raise
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+
+def save_images (new_fname,img_stack,digits,workers=2,dtype=None,value_range=None,resume=False):
     '''
     This function saves the stack of corrected images in the directory
-    and with the filename prefix expressed by new_fname.
+    and with the filename prefix expressed by new_fname, with a pool of
+    threads (see ImageWriter). If resume is True, the images already saved
+    by a previous run are not saved again.
 
     Parameters
     ----------
@@ -318,6 +1399,17 @@ def save_images (new_fname,img_stack,digits):
         3D array of the corrected images
     digits : int
         number of digits used for the numbering of the images
+    workers : int, optional
+        number of threads writing the images. Default value is 2
+    dtype : str, optional
+        type of the saved images: 'float32' or 'uint16'. Default is None (type of the images)
+    value_range : tuple, optional
+        (minimum,maximum) values rescaled to 0 and 65535 when dtype is 'uint16'. Default is None
+    resume : bool, optional
+        whether to keep the images saved by a previous run (see ImageWriter). Default is False
     '''
     print('Saving the corrected images...')
-    ntp.write_tiff_stack(new_fname,img_stack, axis=0, start=0, croi=None, digit=digits, dtype=None, overwrite=False)
\ No newline at end of file
+    with ImageWriter(new_fname,digits,workers,dtype=dtype,value_range=value_range,resume=resume) as writer:
+        for i in tqdm(range(img_stack.shape[0]), unit=' images'):
+            if not writer.is_saved(i):
+                writer.submit(i,img_stack[i])
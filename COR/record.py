@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+import numpy as np
+
+
+RECORD_FILE = 'results.json'
+
+
+def record_path (datapath):
+    '''
+    This function returns the path of the file results.json in the directory datapath.
+
+    Parameters
+    ----------
+    datapath : str
+        string representing the directory path where results.json is placed
+
+    Returns
+    -------
+    path : str
+        the path of results.json
+    '''
+    return os.path.join(datapath, RECORD_FILE)
+
+
+def to_json (value):
+    '''
+    This function converts the numpy numbers and arrays saved in the record
+    to the corresponding python numbers and lists.
+
+    Parameters
+    ----------
+    value : numpy.generic or ndarray
+        the value to convert
+
+    Returns
+    -------
+    value : int, float or list
+        the converted value
+
+    Raises
+    ------
+    TypeError
+        if the value can not be saved in a .json file
+    '''
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError('{0} can not be saved in {1}'.format(type(value).__name__, RECORD_FILE))
+
+
+def read_json (path):
+    '''
+    This function reads the .json file path.
+
+    Parameters
+    ----------
+    path : str
+        the path of the .json file
+
+    Returns
+    -------
+    content : dict
+        the content of the file (empty if the file does not exist)
+    '''
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def read_record (datapath):
+    '''
+    This function reads the record of the results saved in results.json in the directory datapath.
+
+    Parameters
+    ----------
+    datapath : str
+        string representing the directory path where results.json is placed
+
+    Returns
+    -------
+    results : dict
+        the content of results.json (empty if the file does not exist)
+    '''
+    return read_json(record_path(datapath))
+
+
+def write_json (path,content):
+    '''
+    This function writes content in the .json file path, replacing the previous one.
+    The content is written in a temporary file in the same directory which then
+    replaces path, so the file is always complete, also if the program is stopped
+    while it is written. The file is created with the default permissions (those
+    allowed by the umask), so the results can be shared with the other users.
+
+    Parameters
+    ----------
+    path : str
+        the path of the .json file
+    content : dict
+        the content of the file
+    '''
+    tmp_path = os.path.join(os.path.dirname(path), '.{0}.{1}.tmp'.format(os.path.basename(path), uuid.uuid4().hex))
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(content, file, indent=2, default=to_json)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_record (datapath,results):
+    '''
+    This function writes the record of the results in results.json in the directory datapath,
+    replacing the previous one (see write_json()).
+
+    Parameters
+    ----------
+    datapath : str
+        string representing the directory path where results.json is placed
+    results : dict
+        the record of the results
+    '''
+    write_json(record_path(datapath),results)
+
+
+def update_record (datapath,**fields):
+    '''
+    This function adds the given fields to the record of the results saved in results.json
+    in the directory datapath (see write_record()), replacing the fields with the same name.
+
+    Parameters
+    ----------
+    datapath : str
+        string representing the directory path where results.json is placed
+    fields
+        the fields of the record to save
+
+    Returns
+    -------
+    results : dict
+        the updated record
+    '''
+    results = read_record(datapath)
+    results.update(fields)
+    write_record(datapath,results)
+    return results
+
+
+def delete_record (datapath):
+    '''
+    This function deletes results.json in the directory datapath, if it exists.
+
+    Parameters
+    ----------
+    datapath : str
+        string representing the directory path where results.json is placed
+    '''
+    path = record_path(datapath)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def files_checksum (files):
+    '''
+    This function returns a checksum of a list of files computed from their names,
+    sizes and modification times: it changes when a file is added, removed or modified,
+    without reading the content of the files.
+
+    Parameters
+    ----------
+    files : list
+        list of strings representing the paths of the files
+
+    Returns
+    -------
+    checksum : str
+        the SHA-256 hexadecimal digest
+    '''
+    digest = hashlib.sha256()
+    for filename in files:
+        stat = os.stat(filename)
+        digest.update('{0}\0{1}\0{2}\n'.format(os.path.basename(filename), stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()
+
+
+def axis_key (proj_0,proj_180,**options):
+    '''
+    This function returns the key of the estimate of the axis of rotation in the cache
+    (see read_cached_axis()): a hash of the content of the preprocessed projections at
+    0° and 180°, which depend on the images, on the dark and flat images, on the ROI and on
+    the preprocessing, and of the options of the estimate.
+
+    Parameters
+    ----------
+    proj_0 : ndarray
+        2D array of the preprocessed projection at 0°
+    proj_180 : ndarray
+        2D array of the preprocessed projection at 180°
+    options
+        the options of the estimate (e.g. the rows and the options of
+        preprocess_and_correction.find_shift_and_tilt_angle())
+
+    Returns
+    -------
+    key : str
+        the SHA-256 hexadecimal digest
+    '''
+    digest = hashlib.sha256()
+    for proj in (proj_0, proj_180):
+        proj = np.ascontiguousarray(proj)
+        digest.update('{0}{1}'.format(proj.dtype.str, proj.shape).encode())
+        digest.update(proj)
+    digest.update(json.dumps(options, sort_keys=True, default=to_json).encode())
+    return digest.hexdigest()
+
+
+def read_cached_axis (cache_dir,key):
+    '''
+    This function reads the estimate of the axis of rotation saved in the cache
+    directory cache_dir with the given key (see cache_axis()).
+
+    Parameters
+    ----------
+    cache_dir : str
+        the directory of the cache
+    key : str
+        the key of the estimate (see axis_key())
+
+    Returns
+    -------
+    axis : dict or None
+        the shift ('shift'), the tilt angle ('theta') and the fit ('fit') of the
+        axis of rotation, None if the estimate is not in the cache
+    '''
+    return read_json(os.path.join(cache_dir, key + '.json')) or None
+
+
+def cache_axis (cache_dir,key,axis):
+    '''
+    This function saves the estimate of the axis of rotation in the cache directory
+    cache_dir with the given key, so it is not computed again for the same projections
+    and options. The directory is created if it does not exist.
+
+    Parameters
+    ----------
+    cache_dir : str
+        the directory of the cache
+    key : str
+        the key of the estimate (see axis_key())
+    axis : dict
+        the shift ('shift'), the tilt angle ('theta') and the fit ('fit') of the axis of rotation
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    write_json(os.path.join(cache_dir, key + '.json'),axis)
+
+
+class StageTimer:
+    '''
+    This class measures the time spent in the successive stages of the program.
+
+    Methods
+    ------------
+    __init__(self)
+        starts measuring the time of the first stage.
+
+    lap(self,stage)
+        ends the current stage, saving its time (in seconds) in timings with the name stage,
+        and starts the following one.
+    '''
+    def __init__ (self):
+        self.timings = {}
+        self.start = time.perf_counter()
+
+    def lap (self,stage):
+        now = time.perf_counter()
+        self.timings[stage] = round(now - self.start, 3)
+        self.start = now
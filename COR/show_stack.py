@@ -1,43 +1,75 @@
+import functools
+import math
 import matplotlib.pyplot as plt
+import numpy as np
+import preparation_data
 
 
 class IndexTracker:
     '''
     In this class all the characteristics for the visualization of 
     a stack of images are set.
+    The images are shown as previews, downsampled so that their largest
+    dimension is not greater than max_size: each preview is computed only when
+    its image is shown and the last cache_size previews are kept in memory, so a
+    memory-mapped stack or a list of files is never loaded all at once.
 
     Methods
     ------------
-    __init__(self,ax,X)
+    __init__(self,ax,X,max_size=1024,cache_size=16)
         initialize the image window with a specific title and structure.
         The visualization of images in a stack starts with the image in the middle.
     
+    preview(self,ind)
+        returns the downsampled image with index ind (cached).
+
     on_scroll(self,ax,X)
         allows to scroll through the images pressing the right/left arrow key on the keyboard.
 
     update(self,event)
         updates the visualized slice and the label on the y-axis.
     '''
-    def __init__(self, ax, X):
+    def __init__(self, ax, X, max_size=1024, cache_size=16):
         '''
         this method create a image window with title 'use arrow keys to navigate images'
         to show in gray-level map the stack X, which has 3 dimensions, one for the slices, one for 
-        the rows and one for the columns.
+        the rows and one for the columns. X can also be a list of paths of images, read when they are shown.
         The visualization starts with the slice in the middle of the stack.
+        The images are downsampled by the same step along rows and columns, so that
+        their largest dimension is not greater than max_size (if max_size is None the
+        images are shown at full resolution), while the axes keep the coordinates of the
+        full resolution images.
         '''
 
         self.ax = ax
         ax.set_title('use arrow keys to navigate images')
 
         self.X = X
-        self.slices = X.shape[0]
-        self.rows = X.shape[1]
-        self.cols  = X.shape[2]
+        if isinstance(X, (list, tuple)):        #file-backed stack: the images are read when they are shown
+            self.slices = len(X)
+            self.rows, self.cols = preparation_data.read_gray_image(X[0]).shape
+        else:
+            self.slices = X.shape[0]
+            self.rows = X.shape[1]
+            self.cols  = X.shape[2]
         self.ind = self.slices//2
 
-        self.im = ax.imshow(self.X[self.ind, :, :],cmap='gray')
+        self.step = 1 if max_size is None else max(1, math.ceil(max(self.rows, self.cols) / max_size))
+        self.preview = functools.lru_cache(maxsize=cache_size)(self.load_preview)
+
+        self.im = ax.imshow(self.preview(self.ind),cmap='gray',extent=(-0.5, self.cols - 0.5, self.rows - 0.5, -0.5))
         self.update()
 
+    def load_preview(self, ind):
+        '''
+        This method reads the image with index ind and returns it downsampled by
+        step along rows and columns: just the pixels of the preview are read
+        from a memory-mapped stack.
+        '''
+        if isinstance(self.X, (list, tuple)):
+            return preparation_data.read_gray_image(self.X[ind])[::self.step, ::self.step]
+        return np.array(self.X[ind, ::self.step, ::self.step])
+
     def on_scroll(self, event):
         '''
         This method allows to scroll through the successive image pressing the right arrow key on the keyboard
@@ -52,25 +84,32 @@ class IndexTracker:
     def update(self):
         '''
         This method updates the visualized slice and the label
-        of y-axis when the slice changes.'''
+        of y-axis when the slice changes. The figure is redrawn when the
+        window is idle, so pressing the keys quickly does not queue a redraw for each image.'''
 
-        self.im.set_data(self.X[self.ind, :, :])
+        self.im.set_data(self.preview(self.ind))
         self.ax.set_ylabel('projection %s' % self.ind)
-        self.im.axes.figure.canvas.draw()
+        self.im.axes.figure.canvas.draw_idle()
 
 
 
-def plot_tracker (img_array):
+def plot_tracker (img_array, max_size=1024, cache_size=16):
     '''
-    This function shows a stack of images with the possibility to 
-    scroll through the images pressing the right or left arrow key on the keyboard
-    
+    This function shows a stack of images with the possibility to
+    scroll through the images pressing the right or left arrow key on the keyboard.
+    The images are shown as downsampled previews, computed only when they are shown (see IndexTracker).
+
     Parameters
     ----------
-    img_array : ndarray
-        three dimensional stack of images
+    img_array : ndarray or list
+        three dimensional stack of images (also memory-mapped), or list of paths of images
+    max_size : int, optional
+        maximum number of pixels of the largest dimension of the previews.
+        Default value is 1024 (None for full resolution)
+    cache_size : int, optional
+        number of previews kept in memory. Default value is 16
     '''
     fig, ax = plt.subplots(1, 1)
-    tracker = IndexTracker(ax, img_array)
+    tracker = IndexTracker(ax, img_array, max_size, cache_size)
     fig.canvas.mpl_connect('key_press_event', tracker.on_scroll)
     plt.show()
@@ -1,10 +1,8 @@
 import matplotlib.pyplot as plt
-import neutompy as ntp
 import numpy as np
 import cv2
 from matplotlib.offsetbox import AnchoredText
-import SimpleITK as sitk
-from neutompy.preproc.preproc import rotate_sitk as rotate_sitk
+from preprocess_and_correction import rotate_and_shift, rows_for_correction
 
 
 def draw_ROI (img,title,ratio=0.85):
@@ -48,6 +46,7 @@ def draw_ROI (img,title,ratio=0.85):
         raise ValueError("The image array must be two-dimensional.")
 
 	# window size settings
+    import neutompy as ntp      #imported only when needed, since it slows down the start of the program
     (width, height) = ntp.get_screen_resolution()
     scale_width = width / img.shape[1]
     scale_height = height / img.shape[0]
@@ -116,8 +115,8 @@ def ROIs_for_correction(ref_proj,ystep=5):
         else:
             print('Not valid input.')
     
-    #array containing that contains the y points within the rois selected by the user
-    y_of_ROIs = np.array([], dtype=np.int32)
+    #ranges of rows of the rois selected by the user
+    row_ranges = []
 
     # ROI selection
     for i in range(0, nroi):
@@ -125,9 +124,10 @@ def ROIs_for_correction(ref_proj,ystep=5):
         print('> Select ROI ' + str(i+1))
         title = 'Select region n. : ' + str(i+1)
         ymin, ymax, xmin, xmax = draw_ROI(ref_proj, title)
-        
-        y_ROI = np.arange(ymin, ymax +1, ystep)
-        y_of_ROIs = np.concatenate((y_of_ROIs, y_ROI), axis=0)
+        row_ranges.append((ymin, ymax))
+
+    #array containing the y points within the rois selected by the user
+    y_of_ROIs = rows_for_correction(row_ranges, ystep)
         
     return y_of_ROIs
 
@@ -162,8 +162,8 @@ def graph_axis_rotation (proj_0,proj_180,y_of_ROIs,m,q,shift,offset,middle_shift
         (ref. find_shift_and_tilt_angle function)
     offset : float
         shift of the axis of rotation with respect to the central vertical axis of the images (in px)
-    middle_shift : int
-        the offset value converted to integer 
+    middle_shift : int or float
+        the offset value converted to integer (or the fractional offset in the sub-pixel estimation)
     theta : float
         the tilt angle of the rotation axis with respect to the central vertical axis of the images (in degrees)
     '''
@@ -216,8 +216,8 @@ def graph_axis_rotation (proj_0,proj_180,y_of_ROIs,m,q,shift,offset,middle_shift
 
     plt.legend()
 
-    p0_r = np.roll(rotate_sitk(proj_0, theta, interpolator=sitk.sitkLinear),    middle_shift , axis=1) 
-    p90_r = np.roll(rotate_sitk(proj_180, theta, interpolator=sitk.sitkLinear),  middle_shift, axis=1)
+    p0_r = rotate_and_shift(proj_0, theta, middle_shift)
+    p90_r = rotate_and_shift(proj_180, theta, middle_shift)
 
 
 	# FIGURE with difference image and histogram
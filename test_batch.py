@@ -0,0 +1,111 @@
+import sys
+sys.path.insert(0,".\\COR")
+import pytest
+from COR import batch
+import csv
+import os
+from unittest import mock
+
+
+
+def test_scan_configs_template (tmp_path):
+    '''
+    Test for batch.scan_configs() with configuration files and a template.
+    The test asserts that the configuration files are listed without reading them,
+    and that a configuration is obtained from the template for each directory matching
+    the pattern (not for the files), replacing {scan} with the directory.
+    '''
+    for scan in ('scan_b','scan_a'):
+        os.mkdir(str(tmp_path / scan))
+    open(str(tmp_path / 'scan_c'),'w').close()
+    template = str(tmp_path / 'template.ini')
+    with open(template,'w') as file:
+        file.write('[directories]\ndirpath_tomo = {scan}/projections\n[angle]\nangle = 180\n')
+
+    scan_list = batch.scan_configs(['config_1.ini'],str(tmp_path / 'scan_*'),template)
+
+    scan_a, scan_b = str(tmp_path / 'scan_a'), str(tmp_path / 'scan_b')
+    assert scan_list == [('config_1.ini', None),
+                         (scan_a, {'directories': {'dirpath_tomo': scan_a + '/projections'}, 'angle': {'angle': '180'}}),
+                         (scan_b, {'directories': {'dirpath_tomo': scan_b + '/projections'}, 'angle': {'angle': '180'}})]
+
+def test_scan_configs_scans_without_template ():
+    '''
+    Test for batch.scan_configs() when -scans is given without -template.
+    The test asserts that a ValueError is raised.
+    '''
+    with pytest.raises(ValueError) as e:
+        batch.scan_configs([],'scan_*')
+    assert str(e.value) == '-scans and -template must be used together'
+
+def test_scan_configs_no_tomography (tmp_path):
+    '''
+    Test for batch.scan_configs() when no directory matches the pattern.
+    The test asserts that a ValueError is raised.
+    '''
+    template = str(tmp_path / 'template.ini')
+    open(template,'w').close()
+    with pytest.raises(ValueError) as e:
+        batch.scan_configs([],str(tmp_path / 'scan_*'),template)
+    assert str(e.value) == 'there is no tomography to process'
+
+def test_process_scan_results ():
+    '''
+    Test for batch.process_scan() when the tomography is processed.
+    The test asserts that the results of the pipeline, the time and the status 'ok' are returned.
+    '''
+    sections = {'directories': {'dirpath_tomo': 'scan/projections'}}
+    with mock.patch.object(batch.main,'run',return_value=dict(offset=2.5,shift=2,theta=0.1,residual=0.01)) as run:
+        results = batch.process_scan('scan',sections,['-estimate'])
+
+    args, config = run.call_args[0]
+    assert args.headless and args.estimate
+    assert config.get('directories','dirpath_tomo') == 'scan/projections'
+    assert results['status'] == 'ok'
+    assert (results['offset'],results['shift'],results['theta'],results['residual']) == (2.5,2,0.1,0.01)
+    assert results['seconds'] >= 0
+
+def test_process_scan_errors (tmp_path):
+    '''
+    Test for batch.process_scan() when the tomography can not be processed.
+    The test asserts that the errors (a missing configuration file, a configuration
+    without the required sections) are not raised but reported in the status.
+    '''
+    missing = str(tmp_path / 'missing.ini')
+    results = batch.process_scan(missing,None,[])
+    assert results['status'] == 'OSError: file {0} does not exist'.format(missing)
+    assert results['offset'] == ''
+
+    results = batch.process_scan('scan',{'angle': {'angle': '180'}},[])
+    assert results['status'].startswith('NoSectionError')
+
+def test_batch_missing_config (tmp_path):
+    '''
+    Test for batch.batch() when a configuration file does not exist.
+    The test asserts that the batch is not stopped and that the error of the
+    tomography is reported in the summary.
+    '''
+    missing = str(tmp_path / 'missing.ini')
+    summary = str(tmp_path / 'summary.csv')
+    results = batch.batch([missing,'-summary',summary])
+
+    assert [r['status'] for r in results] == ['OSError: file {0} does not exist'.format(missing)]
+    with open(summary, newline='') as file:
+        assert [row['scan'] for row in csv.DictReader(file)] == [missing]
+
+def test_write_summary (tmp_path):
+    '''
+    Test for batch.write_summary().
+    The test asserts that the .csv file has a header and a row for each tomography,
+    with the offset, the shift, the tilt angle, the residual, the time and the status.
+    '''
+    summary = str(tmp_path / 'summary.csv')
+    results = [dict(scan='scan_a',offset=2.5,shift=2,theta=0.1,residual=0.01,seconds=1.5,status='ok'),
+               dict(scan='scan_b',offset='',shift='',theta='',residual='',seconds=0.1,status='OSError: file scan_b does not exist')]
+    batch.write_summary(summary,results)
+
+    with open(summary, newline='') as file:
+        rows = list(csv.reader(file))
+    assert rows == [['scan','offset','shift','theta','residual','seconds','status'],
+                    ['scan_a','2.5','2','0.1','0.01','1.5','ok'],
+                    ['scan_b','','','','','0.1','OSError: file scan_b does not exist']]
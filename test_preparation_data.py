@@ -1,6 +1,7 @@
 import pytest
 import COR.preparation_data as preparation_data
 import numpy as np
+import cv2
 import os
 from hypothesis import given
 import hypothesis.strategies as st
@@ -210,3 +211,214 @@ def test_projection_0_180_wrong_angle ():
     with pytest.raises(ValueError) as err:
         preparation_data.projection_0_180(angle,array_corr)
     assert str(err.value) == 'the maximum angle for the tomography must be 180 or 360 degrees'
+
+def test_read_stack_equal_create_array ():
+    '''
+    Test for preparation_data.read_stack(), that reads the images of a directory
+    directly in a 3D array using a pool of threads.
+    The test asserts that the array is made of float32 and that it is equal to the one
+    obtained reading the list of images with preparation_data.reader_gray_images()
+    and converting it with preparation_data.create_array().
+    '''
+    filepath = os.path.join('testing_images','tomography','projections')
+    img_list = preparation_data.reader_gray_images(filepath)
+    img_stack = preparation_data.read_stack(filepath,workers=3)
+
+    assert img_stack.dtype == np.float32
+    assert np.array_equal(img_stack,preparation_data.create_array(img_list,img_list))
+
+def test_read_stack_different_dimensions (tmp_path):
+    '''
+    Test for preparation_data.read_stack() when the directory contains
+    images with different dimensions.
+    It asserts the raise of ValueError with the correct message.
+    '''
+    cv2.imwrite(str(tmp_path / 'proj_0.tiff'), np.zeros((4,5),dtype=np.uint16))
+    cv2.imwrite(str(tmp_path / 'proj_1.tiff'), np.zeros((6,5),dtype=np.uint16))
+
+    with pytest.raises(ValueError) as e:
+        preparation_data.read_stack(str(tmp_path))
+    assert str(e.value) == '{0} should contain images with the same dimensions'.format(str(tmp_path))
+
+def test_tiff_files_natural_order (tmp_path):
+    '''
+    Test for preparation_data.tiff_files() when the numbering of the files
+    has not a fixed number of digits.
+    It asserts that the files are sorted in natural order
+    (proj_2 before proj_10) and not in alphabetical order.
+    '''
+    for i in [10, 2, 1, 0, 21]:
+        cv2.imwrite(str(tmp_path / 'proj_{0}.tiff'.format(i)), np.zeros((2,2),dtype=np.uint16))
+
+    files = preparation_data.tiff_files(str(tmp_path))
+    assert [os.path.basename(f) for f in files] == ['proj_0.tiff','proj_1.tiff','proj_2.tiff','proj_10.tiff','proj_21.tiff']
+
+def test_tiff_files_file_index (tmp_path):
+    '''
+    Test for preparation_data.tiff_files() when a text file listing the
+    files in the order of acquisition is given.
+    It asserts that the order of the list is kept, ignoring empty lines and comments.
+    '''
+    for name in ['b.tiff','a.tiff','c.tiff']:
+        cv2.imwrite(str(tmp_path / name), np.zeros((2,2),dtype=np.uint16))
+    index = tmp_path / 'index.txt'
+    index.write_text('# order of acquisition\nc.tiff\n\na.tiff\nb.tiff\n')
+
+    files = preparation_data.tiff_files(str(tmp_path),str(index))
+    assert [os.path.basename(f) for f in files] == ['c.tiff','a.tiff','b.tiff']
+
+def test_tiff_files_file_index_missing_file (tmp_path):
+    '''
+    Test for preparation_data.tiff_files() when the text file listing the
+    files contains a file that does not exist.
+    It asserts the raise of OSError with the correct message.
+    '''
+    index = tmp_path / 'index.txt'
+    index.write_text('missing.tiff\n')
+
+    with pytest.raises(OSError) as e:
+        preparation_data.tiff_files(str(tmp_path),str(index))
+    assert str(e.value) == 'file {0} listed in {1} does not exist'.format(os.path.join(str(tmp_path),'missing.tiff'),str(index))
+
+def test_create_array_one_img_view ():
+    '''
+    Test for the preparation_data.create_array() function when the initial
+    list contains one element and the reference is given as a shape.
+    The test asserts that the returned array is a read-only view of the
+    same image repeated (stride 0 along the first axis), with the required shape.
+    '''
+    np.random.seed(0)
+    test_list = np.random.rand(1,2,2).tolist()
+    fin_array = preparation_data.create_array(test_list,(1000,2,2))
+
+    assert fin_array.shape == (1000,2,2)
+    assert fin_array.strides[0] == 0
+    assert not fin_array.flags.writeable
+    assert np.allclose(fin_array[999],test_list[0])
+
+@pytest.mark.parametrize('mode,func',[('mean',np.mean),('median',np.median)])
+def test_reference_image (tmp_path,mode,func):
+    '''
+    Test for preparation_data.reference_image(), that combines the images of a directory
+    (dark or flat images) in a single image.
+    The test asserts that the result is the pixel-wise mean or median of the images,
+    also when the median is computed on bands of rows smaller than the images.
+    '''
+    np.random.seed(0)
+    images = np.random.randint(0,4000,(5,7,6)).astype(np.uint16)
+    for i in range(5):
+        cv2.imwrite(str(tmp_path / 'flat_{0}.tiff'.format(i)), images[i])
+
+    ref_img = preparation_data.reference_image(str(tmp_path),mode,band_rows=3)
+
+    assert ref_img.shape == (7,6)
+    assert ref_img.dtype == np.float32
+    assert np.allclose(ref_img,func(images.astype(np.float64),axis=0))
+
+def test_reference_image_median_by_bands (tmp_path):
+    '''
+    Test for preparation_data.reference_image() with the median of many images.
+    The test asserts that the result is the pixel-wise median of the images and that
+    the peak of the memory allocated while computing it is much lower than the size of
+    all the images, since just a band of rows of each image is read at a time.
+    '''
+    import tifffile
+    import tracemalloc
+    np.random.seed(1)
+    nimages, rows, cols = 32, 256, 256
+    images = np.random.randint(0,4000,(nimages,rows,cols)).astype(np.uint16)
+    for i in range(nimages):
+        tifffile.imwrite(str(tmp_path / 'flat_{0:02d}.tiff'.format(i)), images[i])
+    expected = np.median(images,axis=0)
+    size = images.nbytes
+    del images
+
+    tracemalloc.start()
+    ref_img = preparation_data.reference_image(str(tmp_path),'median',band_rows=4)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert np.allclose(ref_img,expected)
+    assert peak < size / 4
+
+def test_reference_image_wrong_mode ():
+    '''
+    Test for preparation_data.reference_image() when the mode used to combine the
+    images is different from 'mean' or 'median'.
+    It asserts the raise of ValueError with the correct message.
+    '''
+    with pytest.raises(ValueError) as e:
+        preparation_data.reference_image(os.path.join('testing_images','tomography','flat'),'max')
+    assert str(e.value) == 'the mode for the reference image must be mean or median'
+
+@pytest.mark.parametrize('angle,index_180',[(180,8),(360,4)])
+def test_files_0_180 (tmp_path,angle,index_180):
+    '''
+    Test for preparation_data.files_0_180(), that selects the files of the projections
+    at 0° and 180° without reading them.
+    The test asserts that the files are the ones of the projections returned by
+    projection_0_180() when the whole stack is read.
+    '''
+    np.random.seed(0)
+    images = np.random.randint(0,4000,(9,4,5)).astype(np.uint16)
+    for i in range(9):
+        cv2.imwrite(str(tmp_path / 'tomo_{0}.tiff'.format(i)), images[i])
+
+    file_0, file_180 = preparation_data.files_0_180(angle,str(tmp_path))
+    proj_0, proj_180 = preparation_data.projection_0_180(angle,preparation_data.read_stack(str(tmp_path)))
+
+    assert file_0 == os.path.join(str(tmp_path),'tomo_0.tiff')
+    assert file_180 == os.path.join(str(tmp_path),'tomo_{0}.tiff'.format(index_180))
+    two_proj = preparation_data.read_images([file_0,file_180],workers=2)
+    assert np.array_equal(two_proj[0],proj_0)
+    assert np.array_equal(two_proj[1],proj_180)
+
+def test_files_0_180_wrong_angle ():
+    '''
+    Test for preparation_data.files_0_180() when the last angle of acquisition
+    is different from 180 or 360.
+    It asserts the raise of ValueError with the correct message.
+    '''
+    with pytest.raises(ValueError) as e:
+        preparation_data.files_0_180(90,os.path.join('testing_images','tomography','projections'))
+    assert str(e.value) == 'the maximum angle for the tomography must be 180 or 360 degrees'
+
+def test_read_stack_scratch_dir (tmp_path):
+    '''
+    Test for preparation_data.read_stack() when the stack is stored in a memory-mapped
+    file of a scratch directory.
+    The test asserts that the result is a numpy.memmap with the same values of the
+    stack read in memory.
+    '''
+    filepath = os.path.join('testing_images','tomography','projections')
+    img_stack = preparation_data.read_stack(filepath)
+    img_memmap = preparation_data.read_stack(filepath,scratch_dir=str(tmp_path))
+
+    assert isinstance(img_memmap,np.memmap)
+    assert img_memmap.dtype == np.float32
+    assert np.array_equal(img_memmap,img_stack)
+
+def test_allocate_stack_wrong_scratch_dir ():
+    '''
+    Test for preparation_data.allocate_stack() when the scratch directory does not exist.
+    It asserts the raise of OSError with the correct message.
+    '''
+    scratch_dir = os.path.join('testing_images','no_dir')
+    with pytest.raises(OSError) as e:
+        preparation_data.allocate_stack((2,3,3),scratch_dir=scratch_dir)
+    assert str(e.value) == 'directory {0} does not exist'.format(scratch_dir)
+
+def test_read_stack_roi ():
+    '''
+    Test for preparation_data.read_stack() when the coordinates of a ROI are given,
+    so just the ROI of the images is read.
+    The test asserts that the result is equal to the stack of the whole images cropped
+    with the same ROI.
+    '''
+    filepath = os.path.join('testing_images','tomography','projections')
+    img_stack = preparation_data.read_stack(filepath)
+    img_stack_roi = preparation_data.read_stack(filepath,roi=(10,500,20,300))
+
+    assert img_stack_roi.shape == (img_stack.shape[0],490,280)
+    assert np.array_equal(img_stack_roi,img_stack[:,10:500,20:300])
+
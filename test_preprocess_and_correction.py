@@ -1,12 +1,16 @@
 import sys
+import subprocess
 sys.path.insert(0,".\\COR")
 import pytest
 from COR import preparation_data
 from COR import preprocess_and_correction
+from COR import record
 import numpy as np
 import math
+import os
 from unittest import mock
 import cv2
+import neutompy as ntp
 from hypothesis import given
 from hypothesis import settings
 import hypothesis.strategies as st
@@ -245,6 +249,57 @@ def test_find_offset_angle (projection,yROI_list):
 
 
 
+@given(projection=array_2D,
+       yROI_list=list_yROI)
+@settings(deadline=None)
+def test_sse_curves_fft_equal_direct (projection,yROI_list):
+    '''
+    The test asserts that the errors computed for all the shifts through
+    the cross-correlation in the Fourier space (sse_curves_fft())
+    are equal to the ones computed shifting the rows one pixel at a time (sse_curves_direct()).
+
+    Given
+    -----
+    projection : ndarray
+        2D array representing an image (10x10)
+    yROI_list : list
+        list of two different sorted random integers in [0,9] that represent the minimum and the maximun y coordinates
+        of the image to consider for the analysis
+    '''
+    rows_0 = projection[yROI_list[0]:yROI_list[1]+1]
+    rows_180_flip = projection[yROI_list[0]:yROI_list[1]+1, ::-1]
+
+    sse_direct = preprocess_and_correction.sse_curves_direct(rows_0,rows_180_flip)
+    sse_fft = preprocess_and_correction.sse_curves_fft(rows_0,rows_180_flip)
+
+    assert np.allclose(sse_direct,sse_fft,rtol=1e-6,atol=1e-6)
+
+
+
+@given(tomo_stack=array_projections,
+       flat_stack=array_flat,
+       dark_stack=array_dark)
+def test_normalization_equal_neutompy (tomo_stack,flat_stack,dark_stack):
+    '''
+    The test asserts that the normalization computed chunk by chunk and in place
+    is equal to the one of neutompy.normalize_proj(), with the same clamping.
+
+    Given
+    -----
+    tomo_stack : ndarray
+        3D array of float numbers representing a stack of images with grey values between 1 and 250
+    flat_stack : ndarray
+        3D array of float numbers representing a stack of flat images with grey values between 250 and 255
+    dark_stack : ndarray
+        3D array of float numbers representing a stack of flat images with grey values between 1 and 10
+    '''
+    stack_ntp = ntp.normalize_proj(tomo_stack,dark_stack,flat_stack,dose_draw=False,crop_draw=False,min_denom=1e-9,min_ratio=1e-10,log=True)
+    stack_norm = preprocess_and_correction.normalization(tomo_stack.copy(),dark_stack,flat_stack,chunk_size=2,workers=2,in_place=True)
+
+    assert np.allclose(stack_norm,stack_ntp,atol=1e-6)
+
+
+
 #==================================
 #UNIT TESTING
 #==================================
@@ -618,3 +673,785 @@ def test_find_shift_and_theta_obj_centr():
     assert np.isclose(offset,shift_known,rtol=1e-1,atol=1e-2)
     assert np.isclose(theta,theta_known,rtol=1e-1,atol=1e-2)
 
+def test_find_shift_and_theta_fft_equal_direct ():
+    '''
+    Test for the equivalence of the two methods used to compute the errors
+    in preprocess_and_correction.find_shift_and_tilt_angle().
+    A synthetic projection with a tilted bright bar is compared with its flipped
+    and shifted copy: the shifts, the offset and the tilt angle
+    estimated with 'direct' and 'fft' methods must be the same.
+    '''
+    np.random.seed(0)
+    proj_0 = np.random.rand(60,80).astype(np.float32)
+    for y in range(60):
+        proj_0[y,20+y//10:35+y//10] += 5.0
+    proj_180 = np.roll(proj_0[:,::-1], 6, axis=1)
+    y_of_ROIs = np.arange(5, 56, 5)
+
+    res_direct = preprocess_and_correction.find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180,method='direct')
+    res_fft = preprocess_and_correction.find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180,method='fft')
+
+    assert np.array_equal(res_direct[2],res_fft[2])
+    assert res_direct[3] == res_fft[3]
+    assert np.isclose(res_direct[5],res_fft[5])
+
+def test_find_shift_and_theta_wrong_method ():
+    '''
+    Test for the raise of ValueError when the method used to compute
+    the errors in preprocess_and_correction.find_shift_and_tilt_angle()
+    is different from 'direct', 'fft' or 'pyramid'.
+    '''
+    np.random.seed(0)
+    proj = np.random.rand(10,10)
+    y_of_ROIs = np.arange(2, 8, 1)
+
+    with pytest.raises(ValueError) as e:
+        preprocess_and_correction.find_shift_and_tilt_angle(y_of_ROIs,proj,proj,method='brute')
+    assert str(e.value) == 'the method for the shift search must be direct, fft or pyramid'
+
+def test_find_shift_and_theta_subpixel ():
+    '''
+    Test for the sub-pixel estimation of the shift in
+    preprocess_and_correction.find_shift_and_tilt_angle().
+    A synthetic projection made of two gaussian profiles is shifted by a fractional
+    number of pixels and flipped to obtain the projection at 180°.
+    The test asserts that the estimated shift of each row is close to the known one
+    and that the offset is not rounded.
+    '''
+    shift_known = 6.4
+    x = np.arange(128)
+    profile = np.exp(-((x-50)/6.0)**2) + 0.5*np.exp(-((x-80)/4.0)**2)
+    proj_0 = np.tile(profile,(40,1)).astype(np.float32)
+    proj_180 = preprocess_and_correction.rotate_and_shift(proj_0,0.0,shift_known)[:,::-1]
+    y_of_ROIs = np.arange(5, 36, 5)
+
+    m,q,shift,offset,middle_shift, theta=preprocess_and_correction.find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180,method='fft',subpixel=True)
+
+    assert np.allclose(shift,shift_known,atol=0.05)
+    assert np.isclose(offset,shift_known*0.5,atol=0.05)
+    assert middle_shift == offset
+
+def test_rotate_and_shift_half_pixel ():
+    '''
+    Test for preprocess_and_correction.rotate_and_shift() without rotation when the shift is
+    a fractional number of pixels: far from the edges, a shift of 2.5 px
+    must be the mean of the image shifted by 2 px and by 3 px (linear interpolation).
+    '''
+    np.random.seed(0)
+    img = np.random.rand(10,20).astype(np.float32)
+    img_shifted = preprocess_and_correction.rotate_and_shift(img,0.0,2.5)
+    expected = 0.5*(np.roll(img,2,axis=1) + np.roll(img,3,axis=1))
+    assert np.allclose(img_shifted[:,5:-5],expected[:,5:-5],atol=1e-6)
+
+def test_find_shift_and_theta_pyramid_equal_direct ():
+    '''
+    Test for the coarse-to-fine search in preprocess_and_correction.find_shift_and_tilt_angle().
+    A synthetic projection with a tilted bright bar is compared with its flipped
+    and shifted copy: the shifts estimated with the 'pyramid' method, which computes
+    the errors just close to the minimum, must be the same of the 'direct' method.
+    '''
+    np.random.seed(0)
+    proj_0 = np.random.rand(60,80).astype(np.float32)
+    for y in range(60):
+        proj_0[y,20+y//10:35+y//10] += 5.0
+    proj_180 = np.roll(proj_0[:,::-1], 6, axis=1)
+    y_of_ROIs = np.arange(5, 56, 5)
+
+    res_direct = preprocess_and_correction.find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180,method='direct')
+    res_pyramid = preprocess_and_correction.find_shift_and_tilt_angle(y_of_ROIs,proj_0,proj_180,method='pyramid',downsampling=4,window=2)
+
+    assert np.array_equal(res_direct[2],res_pyramid[2])
+    assert res_direct[3] == res_pyramid[3]
+
+def test_sse_curves_pyramid_wrong_window ():
+    '''
+    Test for the raise of ValueError when the window of the coarse-to-fine search
+    (preprocess_and_correction.sse_curves_pyramid()) is lower than 1.
+    '''
+    np.random.seed(0)
+    rows = np.random.rand(5,20)
+
+    with pytest.raises(ValueError) as e:
+        preprocess_and_correction.sse_curves_pyramid(rows,rows[:,::-1],downsampling=4,window=0)
+    assert str(e.value) == 'downsampling and window must be greater than zero'
+
+def test_correction_parallel_equal_serial (tmp_path):
+    '''
+    Test for the parallel correction of the images in
+    preprocess_and_correction.correction_axis_rotation().
+    The test asserts that the stack corrected by 3 threads, in chunks of 2 images,
+    is equal to the stack corrected by a single thread.
+    The visualization of the corrected stack is disabled.
+    '''
+    np.random.seed(0)
+    stack = np.random.rand(7,20,30).astype(np.float32)
+
+    with mock.patch('show_stack.plot_tracker'):
+        stack_serial = preprocess_and_correction.correction_axis_rotation(stack.copy(),3,1.5,str(tmp_path),workers=1)
+        stack_parallel = preprocess_and_correction.correction_axis_rotation(stack.copy(),3,1.5,str(tmp_path),workers=3,chunk_size=2)
+
+    assert np.array_equal(stack_serial,stack_parallel)
+
+def test_correction_wrong_workers (tmp_path):
+    '''
+    Test for the raise of ValueError when the number of threads used in
+    preprocess_and_correction.correction_axis_rotation() is lower than 1.
+    '''
+    np.random.seed(0)
+    stack = np.random.rand(3,10,10).astype(np.float32)
+
+    with pytest.raises(ValueError) as e:
+        preprocess_and_correction.correction_axis_rotation(stack,3,1.5,str(tmp_path),workers=0)
+    assert str(e.value) == 'workers and chunk_size must be greater than zero'
+
+def test_rotate_and_shift_no_wrap_around ():
+    '''
+    Test for preprocess_and_correction.rotate_and_shift() without rotation.
+    Shifting an image by an integer number of pixels, the test asserts that
+    the result is equal to np.roll far from the edges, while the columns
+    entering from the left edge take the value of the first column
+    of the image instead of the one of the last columns (no wrap-around).
+    '''
+    np.random.seed(0)
+    img = np.random.rand(10,20).astype(np.float32)
+    img_shifted = preprocess_and_correction.rotate_and_shift(img,0.0,3)
+
+    assert np.allclose(img_shifted[:,3:],np.roll(img,3,axis=1)[:,3:],atol=1e-6)
+    for col in range(3):
+        assert np.allclose(img_shifted[:,col],img[:,0],atol=1e-6)
+
+def test_rotate_and_shift_equal_two_steps ():
+    '''
+    Test for preprocess_and_correction.rotate_and_shift(), which rotates and shifts
+    an image with a single resample. Far from the edges, the result must be close to
+    the one of the rotation with neutompy rotate_sitk followed by np.roll.
+    '''
+    from neutompy.preproc.preproc import rotate_sitk
+    import SimpleITK as sitk
+    x, y = np.meshgrid(np.arange(90), np.arange(60))
+    img = (np.sin(x/7.0) + np.cos(y/5.0)).astype(np.float32)
+    theta = 2.0
+    shift = 5
+
+    img_fused = preprocess_and_correction.rotate_and_shift(img,theta,shift)
+    img_two_steps = np.roll(rotate_sitk(img,theta,interpolator=sitk.sitkLinear),shift,axis=1)
+
+    assert np.allclose(img_fused[10:-10,15:-15],img_two_steps[10:-10,15:-15],atol=1e-2)
+
+def test_normalization_single_reference_equal_stack ():
+    '''
+    Test for preprocess_and_correction.normalization() when the dark and flat
+    images are given as a single 2D image or as a view of the same image repeated
+    (preparation_data.create_array() with one image).
+    The test asserts that the result is equal to the one obtained with the
+    dark and flat images copied for all the projections.
+    '''
+    np.random.seed(0)
+    tomo_stack = np.random.uniform(20,200,(4,6,6)).astype(np.float32)
+    dark = np.random.uniform(1,10,(6,6)).astype(np.float32)
+    flat = np.random.uniform(250,255,(6,6)).astype(np.float32)
+
+    norm_full = preprocess_and_correction.normalization(tomo_stack.copy(),np.repeat(dark[np.newaxis],4,axis=0),np.repeat(flat[np.newaxis],4,axis=0))
+    norm_2D = preprocess_and_correction.normalization(tomo_stack.copy(),dark,flat)
+    norm_view = preprocess_and_correction.normalization(tomo_stack.copy(),
+                                                        preparation_data.create_array([dark],tomo_stack),
+                                                        preparation_data.create_array([flat],tomo_stack))
+
+    assert np.allclose(norm_full,norm_2D)
+    assert np.allclose(norm_full,norm_view)
+
+def test_cropping_repeated_image ():
+    '''
+    Test for preprocess_and_correction.cropping() when the stack is a view of the
+    same image repeated (preparation_data.create_array() with one image).
+    The test asserts that the cropped stack has the correct dimensions, the correct
+    values and that it is still a view of one image (no copy for each projection).
+    '''
+    np.random.seed(0)
+    img = np.random.rand(10,10)
+    stack = preparation_data.create_array([img],(5,10,10))
+
+    stack_cropped = preprocess_and_correction.cropping(stack,2,6,3,8)
+
+    assert stack_cropped.shape == (5,4,5)
+    assert stack_cropped.strides[0] == 0
+    assert np.allclose(stack_cropped[3],img[2:6,3:8])
+
+def test_outliers_filter_type_without_input ():
+    '''
+    Test for preprocess_and_correction.outliers_filter() when the type of outliers is given
+    as a parameter.
+    The test asserts that the user is not asked to choose the type of outliers and that the
+    result is the same obtained answering the question.
+    '''
+    np.random.seed(0)
+    im_stack = np.random.uniform(0.4,0.6,(2,20,20)).astype(np.float32)
+    im_stack[:,10,10] = 10.0
+    with mock.patch('builtins.input',return_value='a'):
+        filt_input = preprocess_and_correction.outliers_filter(im_stack.copy(),2)
+    with mock.patch('builtins.input',side_effect=AssertionError('input should not be called')):
+        filt_param = preprocess_and_correction.outliers_filter(im_stack.copy(),2,outliers='both')
+
+    assert np.array_equal(filt_input,filt_param)
+
+def test_outliers_filter_wrong_type ():
+    '''
+    Test for preprocess_and_correction.outliers_filter() when the type of outliers
+    is different from 'bright', 'dark' or 'both'.
+    It asserts the raise of ValueError with the correct message.
+    '''
+    with pytest.raises(ValueError) as e:
+        preprocess_and_correction.outliers_filter(np.ones((2,5,5),dtype=np.float32),1,outliers='grey')
+    assert str(e.value) == 'the type of outliers must be bright, dark or both'
+
+def test_correction_stream_equal_in_memory (tmp_path):
+    '''
+    Test for preprocess_and_correction.correction_stream(), that reads, crops, normalizes,
+    filters, corrects and saves the projections chunk by chunk.
+    The test asserts that the saved images are equal to the ones obtained processing
+    the whole stack in memory, also when the last chunk is smaller than the others.
+    '''
+    np.random.seed(0)
+    tomo_dir = tmp_path / 'tomo'
+    out_dir = tmp_path / 'out'
+    tomo_dir.mkdir()
+    out_dir.mkdir()
+    for i in range(7):
+        cv2.imwrite(str(tomo_dir / 'tomo_{0}.tiff'.format(i)), np.random.randint(20,200,(12,14)).astype(np.uint16))
+    dark = np.random.uniform(1,10,(12,14)).astype(np.float32)
+    flat = np.random.uniform(250,255,(12,14)).astype(np.float32)
+    files = preparation_data.tiff_files(str(tomo_dir))
+
+    preprocess_and_correction.correction_stream(files,1.5,0.8,str(tmp_path),str(out_dir / 'corr'),3,roi=(1,11,2,13),dark=dark,flat=flat,
+                                                radius_2D_neighborhood=1,outliers='bright',chunk_size=3,workers=2)
+
+    stack = preparation_data.read_stack(str(tomo_dir))[:,1:11,2:13]
+    stack = preprocess_and_correction.normalization(np.ascontiguousarray(stack),dark[1:11,2:13],flat[1:11,2:13])
+    stack = preprocess_and_correction.outliers_filter(stack,1,outliers='bright')
+    preprocess_and_correction.correct_slices(stack,0,7,1.5,0.8)
+
+    assert sorted(os.listdir(str(out_dir))) == ['corr_{0:03d}.tiff'.format(i) for i in range(7)]
+    assert np.allclose(preparation_data.read_stack(str(out_dir)),stack)
+
+def test_rows_for_correction ():
+    '''
+    Test for preprocess_and_correction.rows_for_correction(), that returns the rows
+    of one or multiple ranges used to estimate the axis of rotation.
+    The test asserts that the rows of each range are taken from ymin to ymax (included)
+    with the step ystep, in the order of the ranges.
+    '''
+    y_of_ROIs = preprocess_and_correction.rows_for_correction([(0,10),(20,22)],ystep=5)
+    assert np.array_equal(y_of_ROIs,[0,5,10,20])
+
+def test_rows_for_correction_wrong_range ():
+    '''
+    Test for preprocess_and_correction.rows_for_correction() when ymin is greater than
+    ymax in a range.
+    It asserts the raise of ValueError with the correct message.
+    '''
+    with pytest.raises(ValueError) as e:
+        preprocess_and_correction.rows_for_correction([(0,10),(30,20)])
+    assert str(e.value) == 'ymin must be less than ymax in every range of rows'
+
+def test_residual_zero_for_symmetric_projections ():
+    '''
+    Test for preprocess_and_correction.residual(), that computes the mean absolute
+    difference between the corrected projections at 0° and 180°.
+    The projection at 180° is the flip of the one at 0° shifted by 4 px: the test asserts
+    that the residual is 0 for the correct shift and greater than 0 for a wrong one.
+    '''
+    np.random.seed(0)
+    proj_0 = np.zeros((20,40),dtype=np.float32)
+    proj_0[5:15,10:30] = np.random.uniform(1,2,(10,20))
+    proj_180 = np.roll(proj_0,4,axis=1)[:,::-1]
+
+    assert preprocess_and_correction.residual(proj_0,proj_180,2,0.0) == pytest.approx(0.0)
+    assert preprocess_and_correction.residual(proj_0,proj_180,0,0.0) > 0.1
+
+def test_normalization_and_cropping_scratch_dir (tmp_path):
+    '''
+    Test for preprocess_and_correction.cropping() and preprocess_and_correction.normalization()
+    when the stacks are stored in memory-mapped files of a scratch directory
+    (the images to crop are not float32, so they are copied).
+    The test asserts that the results are numpy.memmap with the same values of the
+    stacks in memory, also when the images are normalized in chunks and the dark and
+    flat images are stacks.
+    '''
+    np.random.seed(0)
+    tomo_stack = np.random.uniform(20,200,(5,8,8)).astype(np.float32)
+    dark_stack = np.random.uniform(1,10,(5,8,8)).astype(np.float32)
+    flat_stack = np.random.uniform(250,255,(5,8,8)).astype(np.float32)
+
+    crop = preprocess_and_correction.cropping(tomo_stack.astype(np.uint16),1,7,2,8)
+    crop_memmap = preprocess_and_correction.cropping(tomo_stack.astype(np.uint16),1,7,2,8,scratch_dir=str(tmp_path))
+    norm = preprocess_and_correction.normalization(tomo_stack.copy(),dark_stack,flat_stack)
+    norm_memmap = preprocess_and_correction.normalization(tomo_stack.copy(),dark_stack,flat_stack,scratch_dir=str(tmp_path),chunk_size=2)
+
+    assert isinstance(crop_memmap,np.memmap)
+    assert np.array_equal(crop_memmap,crop)
+    assert isinstance(norm_memmap,np.memmap)
+    assert np.allclose(norm_memmap,norm)
+
+def test_cropping_float32_view ():
+    '''
+    Test for preprocess_and_correction.cropping() when the images are already float32.
+    The test asserts that the cropped stack is a view of the original stack (no copy),
+    while a stack of a different type is converted to float32.
+    '''
+    img_stack = np.arange(5*10*10,dtype=np.float32).reshape(5,10,10)
+
+    stack_cropped = preprocess_and_correction.cropping(img_stack,2,6,3,8)
+    stack_cropped_uint16 = preprocess_and_correction.cropping(img_stack.astype(np.uint16),2,6,3,8)
+
+    assert np.shares_memory(stack_cropped,img_stack)
+    assert np.array_equal(stack_cropped,img_stack[:,2:6,3:8])
+    assert stack_cropped_uint16.dtype == np.float32
+    assert np.array_equal(stack_cropped_uint16,stack_cropped)
+
+def test_normalization_in_place ():
+    '''
+    Test for preprocess_and_correction.normalization() with in_place=True.
+    The test asserts that the normalized images are written in the float32 stack itself,
+    while a new stack is returned when the images are not float32 or in_place is False.
+    '''
+    np.random.seed(0)
+    tomo_stack = np.random.uniform(20,200,(4,6,6)).astype(np.float32)
+    dark = np.random.uniform(1,10,(6,6)).astype(np.float32)
+    flat = np.random.uniform(250,255,(6,6)).astype(np.float32)
+
+    norm_new = preprocess_and_correction.normalization(tomo_stack,dark,flat)
+    norm_uint16 = preprocess_and_correction.normalization(tomo_stack.astype(np.uint16),dark,flat,in_place=True)
+    norm_in_place = preprocess_and_correction.normalization(tomo_stack,dark,flat,in_place=True)
+
+    assert not np.shares_memory(norm_new,norm_in_place)
+    assert not np.shares_memory(norm_uint16,tomo_stack)
+    assert norm_in_place is tomo_stack
+    assert np.array_equal(norm_in_place,norm_new)
+
+@pytest.mark.parametrize('outliers', ['bright','dark'])
+def test_outliers_filter_equal_neutompy (outliers):
+    '''
+    Test for preprocess_and_correction.outliers_filter() with bright or dark outliers.
+    The test asserts that the images filtered by a pool of threads are equal to the ones
+    filtered by neutompy.remove_outliers_stack().
+    '''
+    np.random.seed(0)
+    im_stack = np.random.uniform(0.4,0.6,(6,20,20)).astype(np.float32)
+    im_stack[:,5,5] = 10.0
+    im_stack[:,12,15] = -10.0
+    stack_ntp = ntp.remove_outliers_stack(im_stack.copy(),2,threshold=0.02,outliers=outliers)
+    stack_filt = preprocess_and_correction.outliers_filter(im_stack.copy(),2,outliers=outliers,workers=2,chunk_size=2)
+
+    assert np.array_equal(stack_filt,stack_ntp)
+
+def test_outliers_filter_both_single_pass ():
+    '''
+    Test for preprocess_and_correction.outliers_filter() with both bright and dark outliers.
+    The test asserts that bright and dark outliers are removed in the same pass,
+    replacing them with the median of the original image, and that the images are filtered in place.
+    '''
+    np.random.seed(0)
+    im_stack = np.random.uniform(0.4,0.6,(4,20,20)).astype(np.float32)
+    im_stack[:,5,5] = 10.0
+    im_stack[:,12,15] = -10.0
+    median = np.stack([ntp.preproc.preproc.median_filter(im,2) for im in im_stack])
+    expected = np.where(np.abs(im_stack - median) > np.float32(0.02), median, im_stack)
+
+    stack_filt = preprocess_and_correction.outliers_filter(im_stack,2,outliers='both',workers=2,chunk_size=3)
+
+    assert stack_filt is im_stack or np.shares_memory(stack_filt,im_stack)
+    assert np.array_equal(stack_filt,expected)
+    assert np.max(stack_filt) < 1.0 and np.min(stack_filt) > 0.0
+
+def test_outliers_filter_wrong_workers ():
+    '''
+    Test for preprocess_and_correction.outliers_filter() when the number of workers is zero.
+    The test asserts that a ValueError is raised.
+    '''
+    with pytest.raises(ValueError) as e:
+        preprocess_and_correction.outliers_filter(np.ones((2,5,5),dtype=np.float32),1,outliers='both',workers=0)
+    assert str(e.value) == 'workers and chunk_size must be greater than zero'
+
+def test_outliers_filter_threshold ():
+    '''
+    Test for preprocess_and_correction.outliers_filter() with the threshold and k given as parameters.
+    The test asserts that the user is not asked anything, that a spot deviating from the median less
+    than k*threshold is kept and that it is removed when k*threshold is lower than its deviation.
+    '''
+    im_stack = np.full((2,15,15),0.5,dtype=np.float32)
+    im_stack[:,7,7] = 1.0
+    with mock.patch('builtins.input',side_effect=AssertionError('input should not be called')):
+        stack_kept = preprocess_and_correction.outliers_filter(im_stack.copy(),2,outliers='bright',threshold=0.3,k=2.0)
+        stack_removed = preprocess_and_correction.outliers_filter(im_stack.copy(),2,outliers='bright',threshold=0.3,k=1.0)
+
+    assert np.array_equal(stack_kept,im_stack)
+    assert np.all(stack_removed == 0.5)
+
+def test_outliers_filter_negative_threshold ():
+    '''
+    Test for preprocess_and_correction.outliers_filter() when the threshold is negative.
+    The test asserts that a ValueError is raised before asking the type of outliers.
+    '''
+    with mock.patch('builtins.input',side_effect=AssertionError('input should not be called')):
+        with pytest.raises(ValueError) as e:
+            preprocess_and_correction.outliers_filter(np.ones((2,5,5),dtype=np.float32),1,threshold=-0.02)
+    assert str(e.value) == 'threshold and k must not be negative'
+
+@pytest.mark.parametrize('outliers', ['bright','dark','both'])
+def test_outliers_filter_separable_median (outliers):
+    '''
+    Test for preprocess_and_correction.outliers_filter() with the separable median.
+    The test asserts that isolated bright and dark outliers are removed as with the exact median,
+    while the other pixels of a smooth image are not modified.
+    '''
+    x = np.linspace(0.4,0.6,30,dtype=np.float32)
+    im_stack = np.stack([np.add.outer(x,x)]*2)
+    im_stack[:,8,20] = 5.0
+    im_stack[:,22,6] = -5.0
+    stack_exact = preprocess_and_correction.outliers_filter(im_stack.copy(),3,outliers=outliers,median='exact')
+    stack_separable = preprocess_and_correction.outliers_filter(im_stack.copy(),3,outliers=outliers,median='separable',workers=2,chunk_size=1)
+
+    assert np.allclose(stack_separable,stack_exact,atol=0.02)
+    assert np.array_equal(stack_separable[:,8,20] < 2.0, stack_exact[:,8,20] < 2.0)
+    assert np.array_equal(stack_separable[:,22,6] > -2.0, stack_exact[:,22,6] > -2.0)
+
+def test_median_image_separable ():
+    '''
+    Test for preprocess_and_correction.median_image() with the separable median and a different
+    radius along x and y.
+    The test asserts that the result is the median along the rows followed by the median along the columns.
+    '''
+    np.random.seed(0)
+    img = np.random.rand(12,16).astype(np.float32)
+    rows = np.array([[np.median(np.pad(r,2,mode='edge')[j:j+5]) for j in range(16)] for r in img])
+    expected = np.array([[np.median(np.pad(c,1,mode='edge')[i:i+3]) for i in range(12)] for c in rows.T]).T
+
+    img_median = preprocess_and_correction.median_image(img,(2,1),median='separable')
+
+    assert img_median.shape == img.shape
+    assert np.allclose(img_median,expected)
+
+def test_outliers_filter_wrong_median ():
+    '''
+    Test for preprocess_and_correction.outliers_filter() when the median is not valid.
+    The test asserts that a ValueError is raised.
+    '''
+    with pytest.raises(ValueError) as e:
+        preprocess_and_correction.outliers_filter(np.ones((2,5,5),dtype=np.float32),1,outliers='both',median='mean')
+    assert str(e.value) == 'the median must be exact or separable'
+
+def test_correction_axis_rotation_writer (tmp_path):
+    '''
+    Test for preprocess_and_correction.correction_axis_rotation() with an ImageWriter.
+    The test asserts that all the corrected images are saved while the stack is corrected,
+    also when just one image at a time can wait to be written.
+    '''
+    np.random.seed(0)
+    stack = np.random.uniform(0,1,(9,10,12)).astype(np.float32)
+    expected = stack.copy()
+    preprocess_and_correction.correct_slices(expected,0,9,2.5,0.7)
+
+    with preprocess_and_correction.ImageWriter(str(tmp_path / 'corr'),4,workers=2,max_pending=1) as writer:
+        preprocess_and_correction.correction_axis_rotation(stack,2.5,0.7,str(tmp_path),workers=3,chunk_size=2,show=False,writer=writer)
+
+    assert sorted(f for f in os.listdir(str(tmp_path)) if f.endswith('.tiff')) == ['corr_{0:04d}.tiff'.format(i) for i in range(9)]
+    assert np.allclose(preparation_data.read_stack(str(tmp_path)),expected)
+
+def test_image_writer_uint16 (tmp_path):
+    '''
+    Test for preprocess_and_correction.ImageWriter with uint16 images.
+    The test asserts that the values of value_range are rescaled to 0 and 65535
+    and that the values out of the range are clipped.
+    '''
+    img = np.array([[-1.0,0.0,0.5],[1.0,2.0,0.25]],dtype=np.float32)
+    with preprocess_and_correction.ImageWriter(str(tmp_path / 'corr'),2,dtype='uint16',value_range=(0.0,1.0)) as writer:
+        writer.submit(0,img)
+
+    saved = cv2.imread(str(tmp_path / 'corr_00.tiff'),cv2.IMREAD_UNCHANGED)
+    assert saved.dtype == np.uint16
+    assert np.array_equal(saved,np.array([[0,0,32768],[65535,65535,16384]]))
+
+def test_image_writer_existing_file (tmp_path):
+    '''
+    Test for preprocess_and_correction.ImageWriter when the file of an image already exists.
+    The test asserts that the error raised by the thread writing the image is raised when the writer is closed.
+    '''
+    cv2.imwrite(str(tmp_path / 'corr_1.tiff'), np.zeros((2,2),dtype=np.uint16))
+    with pytest.raises(OSError) as e:
+        with preprocess_and_correction.ImageWriter(str(tmp_path / 'corr'),1) as writer:
+            writer.submit(0,np.ones((2,2),dtype=np.float32))
+            writer.submit(1,np.ones((2,2),dtype=np.float32))
+    assert str(e.value) == 'File already exists : {0}'.format(str(tmp_path / 'corr_1.tiff'))
+
+def test_image_writer_uint16_without_range ():
+    '''
+    Test for preprocess_and_correction.ImageWriter when uint16 images are required without a range of values.
+    The test asserts that a ValueError is raised.
+    '''
+    with pytest.raises(ValueError) as e:
+        preprocess_and_correction.ImageWriter('corr',3,dtype='uint16')
+    assert str(e.value) == 'a range of values (minimum,maximum) with minimum less than maximum is required to save uint16 images'
+
+def test_import_without_heavy_modules ():
+    '''
+    Test for the start of the program without a user interface.
+    The test imports main.py in a new interpreter and asserts that the graphical modules
+    and the heavy libraries used just by some steps (SimpleITK, scipy, OpenCV, neutompy,
+    matplotlib) are not imported, and that the import takes less than the time budget of 1 s.
+    '''
+    code = ('import sys, time\n'
+            't = time.perf_counter()\n'
+            'import main\n'
+            'print(time.perf_counter() - t)\n'
+            'print(",".join(m for m in ("SimpleITK","scipy","cv2","neutompy","matplotlib","show_stack","user_interaction") if m in sys.modules))\n')
+    cor_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'COR')
+    output = subprocess.run([sys.executable,'-c',code],cwd=cor_dir,capture_output=True,text=True,check=True).stdout.split('\n')
+
+    assert output[1] == ''
+    assert float(output[0]) < 1.0
+
+def test_save_ROI_and_axis_record (tmp_path):
+    '''
+    Test for preprocess_and_correction.save_ROI() and save_axis(), which save the ROI and the
+    axis of rotation in results.json.
+    The test asserts that saving them again replaces the previous values instead of adding new
+    ones, that the other fields are kept and that numpy values are saved as numbers and lists.
+    '''
+    record.write_record(str(tmp_path),dict(inputs=dict(projections='abc')))
+    preprocess_and_correction.save_ROI(1,5,2,8,str(tmp_path))
+    preprocess_and_correction.save_axis(np.int64(3),np.float64(0.5),str(tmp_path))
+    preprocess_and_correction.save_ROI(2,6,3,9,str(tmp_path))
+    preprocess_and_correction.save_axis(-1.5,0.25,str(tmp_path))
+    record.update_record(str(tmp_path),fit=dict(rows=np.arange(3),m=np.float32(0.5)))
+
+    assert sorted(os.listdir(str(tmp_path))) == ['results.json']
+    assert record.read_record(str(tmp_path)) == dict(inputs=dict(projections='abc'),roi=dict(rowmin=2,rowmax=6,colmin=3,colmax=9),
+                                                     shift=-1.5,theta=0.25,fit=dict(rows=[0,1,2],m=0.5))
+
+def test_write_record_not_valid (tmp_path):
+    '''
+    Test for record.write_record() when a value can not be saved in a .json file.
+    The test asserts that a TypeError is raised and that the previous results.json is not modified
+    and no temporary file is left.
+    '''
+    record.write_record(str(tmp_path),dict(shift=1))
+    with pytest.raises(TypeError):
+        record.write_record(str(tmp_path),dict(shift=object()))
+
+    assert os.listdir(str(tmp_path)) == ['results.json']
+    assert record.read_record(str(tmp_path)) == dict(shift=1)
+    record.delete_record(str(tmp_path))
+    assert record.read_record(str(tmp_path)) == {}
+
+@pytest.mark.skipif(os.name == 'nt', reason='the permissions of the umask are POSIX ones')
+def test_write_json_permissions (tmp_path):
+    '''
+    Test for record.write_json().
+    The test asserts that the file is created with the permissions allowed by the umask
+    (not just for the owner), also when it replaces a previous file.
+    '''
+    umask = os.umask(0o022)
+    try:
+        path = str(tmp_path / 'results.json')
+        record.write_json(path,dict(shift=1))
+        assert os.stat(path).st_mode & 0o777 == 0o644
+        record.write_json(path,dict(shift=2))
+        assert os.stat(path).st_mode & 0o777 == 0o644
+        assert record.read_json(path) == dict(shift=2)
+    finally:
+        os.umask(umask)
+
+def test_files_checksum (tmp_path):
+    '''
+    Test for record.files_checksum().
+    The test asserts that the checksum does not change if the files do not change,
+    and that it changes when a file is modified or removed from the list.
+    '''
+    files = [str(tmp_path / 'proj_{0}.tiff'.format(i)) for i in range(3)]
+    for filename in files:
+        cv2.imwrite(filename, np.zeros((2,2),dtype=np.uint16))
+    checksum = record.files_checksum(files)
+    assert record.files_checksum(files) == checksum
+    assert record.files_checksum(files[:2]) != checksum
+
+    cv2.imwrite(files[1], np.zeros((3,3),dtype=np.uint16))
+    assert record.files_checksum(files) != checksum
+
+def test_axis_key ():
+    '''
+    Test for record.axis_key().
+    The test asserts that the key does not change for the same projections and options,
+    and that it changes when a projection or an option changes.
+    '''
+    proj_0 = np.random.rand(10,12).astype(np.float32)
+    proj_180 = np.random.rand(10,12).astype(np.float32)
+    key = record.axis_key(proj_0,proj_180,rows=np.arange(2,8),method='fft')
+    assert key == record.axis_key(proj_0.copy(),proj_180.copy(),rows=np.arange(2,8),method='fft')
+
+    proj_changed = proj_180.copy()
+    proj_changed[5,5] += 1
+    assert record.axis_key(proj_0,proj_changed,rows=np.arange(2,8),method='fft') != key
+    assert record.axis_key(proj_0,proj_180,rows=np.arange(2,8),method='direct') != key
+    assert record.axis_key(proj_0,proj_180,rows=np.arange(2,9),method='fft') != key
+
+
+def test_cache_axis (tmp_path):
+    '''
+    Test for record.cache_axis() and record.read_cached_axis().
+    The test asserts that no estimate is read before it is saved in the cache,
+    and that the saved estimate is read with the same key.
+    '''
+    cache_dir = str(tmp_path / 'cache')
+    key = record.axis_key(np.zeros((4,4)),np.ones((4,4)))
+    assert record.read_cached_axis(cache_dir,key) is None
+
+    fit = dict(rows=np.arange(3),shifts=np.array([2,2,3]),m=np.float64(0.5),q=2.0,offset=2)
+    record.cache_axis(cache_dir,key,dict(shift=np.int64(2),theta=0.25,fit=fit))
+    cached = record.read_cached_axis(cache_dir,key)
+    assert cached['shift'] == 2
+    assert cached['theta'] == 0.25
+    assert cached['fit']['shifts'] == [2,2,3]
+    assert os.listdir(cache_dir) == [key + '.json']
+
+def test_missing_chunks (tmp_path):
+    '''
+    Test for preprocess_and_correction.missing_chunks().
+    The test asserts that without a writer all the images are divided in chunks,
+    and that with a writer just the images not yet saved are, in chunks of consecutive images.
+    '''
+    assert preprocess_and_correction.missing_chunks(7,3) == [(0,3),(3,6),(6,7)]
+
+    with preprocess_and_correction.ImageWriter(str(tmp_path / 'corr'),2) as writer:
+        writer.saved = {1,2,6}
+        assert preprocess_and_correction.missing_chunks(10,2,writer) == [(0,1),(3,5),(5,6),(7,9),(9,10)]
+
+def test_image_writer_resume (tmp_path):
+    '''
+    Test for preprocess_and_correction.ImageWriter with resume.
+    A run is stopped by an error after some images are saved, then the file of a saved
+    image is damaged. The test asserts that the saved images are recorded in the checkpoint,
+    that the run resumed in the same folder keeps just the verified images and corrects and
+    saves the other ones, and that all the saved images are the corrected ones.
+    '''
+    np.random.seed(1)
+    stack = np.random.uniform(0,1,(10,8,8)).astype(np.float32)
+    expected = stack.copy()
+    preprocess_and_correction.correct_slices(expected,0,10,1.5,0.4)
+    fname = str(tmp_path / 'corr')
+
+    with pytest.raises(RuntimeError):
+        with preprocess_and_correction.ImageWriter(fname,2,max_pending=2) as writer:
+            for i in range(6):
+                writer.submit(i,expected[i])
+            raise RuntimeError('stopped')
+    assert record.read_json(fname + '_checkpoint.json')['saved'] == [0,1,2,3,4,5]
+
+    with open(fname + '_03.tiff','wb') as file:       #incomplete file
+        file.write(b'II*')
+    with preprocess_and_correction.ImageWriter(fname,2,resume=True) as writer:
+        assert [writer.is_saved(i) for i in range(10)] == [True]*3 + [False] + [True]*2 + [False]*4
+        preprocess_and_correction.correction_axis_rotation(stack,1.5,0.4,str(tmp_path),chunk_size=3,show=False,writer=writer)
+
+    assert np.array_equal(stack[:3],np.random.RandomState(1).uniform(0,1,(10,8,8)).astype(np.float32)[:3])   #not corrected again
+    assert not os.path.exists(fname + '_checkpoint.json')
+    assert np.allclose(preparation_data.read_stack(str(tmp_path)),expected)
+
+def test_image_writer_resume_other_settings (tmp_path):
+    '''
+    Test for preprocess_and_correction.ImageWriter with resume, when the images were saved with another type.
+    The test asserts that no image is kept and that the files are overwritten.
+    '''
+    fname = str(tmp_path / 'corr')
+    with pytest.raises(RuntimeError):
+        with preprocess_and_correction.ImageWriter(fname,1) as writer:
+            for i in range(3):
+                writer.submit(i,np.ones((4,4),dtype=np.float32))
+            raise RuntimeError('stopped')
+    with preprocess_and_correction.ImageWriter(fname,1,dtype='uint16',value_range=(0.0,2.0),resume=True) as writer:
+        assert not any(writer.is_saved(i) for i in range(3))
+
+    preprocess_and_correction.save_images(fname,np.ones((3,4,4),dtype=np.float32),1,dtype='uint16',value_range=(0.0,2.0),resume=True)
+    assert cv2.imread(fname + '_2.tiff',cv2.IMREAD_UNCHANGED).dtype == np.uint16
+
+def test_image_writer_resume_other_source (tmp_path):
+    '''
+    Test for preprocess_and_correction.ImageWriter with resume, when the previous run was stopped
+    after saving half of the images and the new run has a different shift, tilt angle and shape.
+    The test asserts that no image of the previous run is kept and that all the saved images
+    are the ones of the new run.
+    '''
+    np.random.seed(2)
+    fname = str(tmp_path / 'corr')
+    old = np.random.rand(40,8,8).astype(np.float32)
+    with pytest.raises(RuntimeError):
+        with preprocess_and_correction.ImageWriter(fname,2,resume=True,shape=(8,8),source=dict(shift=1,theta=0.5)) as writer:
+            for i in range(20):
+                writer.submit(i,old[i])
+            raise RuntimeError('stopped')
+
+    with preprocess_and_correction.ImageWriter(fname,2,resume=True,shape=(8,8),source=dict(shift=1,theta=0.5)) as writer:
+        assert all(writer.is_saved(i) for i in range(20))       #same run: the images are kept
+
+    new = np.random.rand(40,6,6).astype(np.float32)
+    with preprocess_and_correction.ImageWriter(fname,2,resume=True,shape=(6,6),source=dict(shift=2,theta=0.25)) as writer:
+        assert not any(writer.is_saved(i) for i in range(40))
+        preprocess_and_correction.correction_axis_rotation(new,2,0.25,str(tmp_path),show=False,writer=writer)
+
+    assert np.allclose(preparation_data.read_stack(str(tmp_path)),new)
+    assert not os.path.exists(fname + '_checkpoint.json')
+
+def test_image_writer_resume_other_shape (tmp_path):
+    '''
+    Test for preprocess_and_correction.ImageWriter with resume, when the shape of the new images
+    is different from the one of the images kept from the previous run and it is not given.
+    The test asserts that the new images are not written, so the folder does not contain images
+    with different shapes, and that the error is raised when the writer is closed.
+    '''
+    fname = str(tmp_path / 'corr')
+    with pytest.raises(RuntimeError):
+        with preprocess_and_correction.ImageWriter(fname,1) as writer:
+            writer.submit(0,np.ones((8,8),dtype=np.float32))
+            raise RuntimeError('stopped')
+
+    with pytest.raises(ValueError) as e:
+        with preprocess_and_correction.ImageWriter(fname,1,resume=True) as writer:
+            assert writer.is_saved(0)
+            writer.submit(1,np.ones((6,6),dtype=np.float32))
+    assert str(e.value) == 'the image 1 has shape (6, 6) and type <f4, while the saved images have shape (8, 8) and type <f4'
+    assert sorted(os.listdir(str(tmp_path))) == ['corr_0.tiff','corr_checkpoint.json']
+
+def test_estimate_axis_cache (tmp_path):
+    '''
+    Test for the cache of the estimates in main.estimate_axis().
+    With the rows given (headless mode), the test asserts that the estimate is computed
+    the first time and read from the cache the second time, and that another set of
+    rows is estimated again. When the user selects the ROIs, the test asserts that the
+    cache is neither read nor written, so the estimate is always shown and accepted.
+    '''
+    from COR import main
+    np.random.seed(3)
+    proj_0, proj_180 = np.random.rand(2,20,30).astype(np.float32)
+    cache_dir = str(tmp_path / 'cache')
+    estimate = (0.01,2.0,np.array([2,2,2]),1.0,1,0.5)      #m,q,shift,offset,middle_shift,theta
+
+    with mock.patch.object(main.preprocess_and_correction,'find_shift_and_tilt_angle',return_value=estimate) as find:
+        rows = np.arange(5,15,5)
+        assert main.estimate_axis(proj_0,proj_180,str(tmp_path),rows,cache_dir) == (1,0.5,1.0)
+        assert main.estimate_axis(proj_0,proj_180,str(tmp_path),rows,cache_dir) == (1,0.5,1.0)
+        assert find.call_count == 1
+        assert record.read_record(str(tmp_path))['cache'] in [f[:-5] for f in os.listdir(cache_dir)]
+        main.estimate_axis(proj_0,proj_180,str(tmp_path),np.arange(5,15,2),cache_dir)
+        assert find.call_count == 2
+
+        user_interaction = mock.MagicMock()
+        user_interaction.ROIs_for_correction.return_value = rows
+        user_interaction.user_choice_for_correction.return_value = 'Y'
+        with mock.patch.dict(sys.modules,{'user_interaction': user_interaction}):
+            interactive_cache = str(tmp_path / 'interactive_cache')
+            for i in range(2):
+                assert main.estimate_axis(proj_0,proj_180,str(tmp_path),None,interactive_cache) == (1,0.5,1.0)
+        assert user_interaction.ROIs_for_correction.call_count == 2
+        assert user_interaction.user_choice_for_correction.call_count == 2
+        assert find.call_count == 4
+        assert not os.path.exists(interactive_cache)
+
@@ -0,0 +1,111 @@
+import sys
+sys.path.insert(0,".\\COR")
+import matplotlib
+matplotlib.use('Agg')                   #no window is opened by the tests
+import matplotlib.pyplot as plt
+from COR import show_stack
+import numpy as np
+import tifffile
+from types import SimpleNamespace
+
+
+
+class CountingTracker (show_stack.IndexTracker):
+    '''
+    IndexTracker recording the indices of the images read by load_preview().
+    '''
+    def __init__ (self, ax, X, max_size=1024, cache_size=16):
+        self.loaded = []
+        super().__init__(ax, X, max_size, cache_size)
+
+    def load_preview (self, ind):
+        self.loaded.append(ind)
+        return super().load_preview(ind)
+
+
+def press (tracker, key):
+    '''
+    This function simulates the pressure of a key on the keyboard.
+    '''
+    tracker.on_scroll(SimpleNamespace(key=key))
+
+
+def test_index_tracker_downsampling ():
+    '''
+    Test for show_stack.IndexTracker with images larger than max_size.
+    The test asserts that the images are downsampled by the same step along rows and columns,
+    so that the largest dimension is not greater than max_size, that the axes keep the
+    coordinates of the full resolution images and that the image in the middle is shown first.
+    '''
+    np.random.seed(0)
+    stack = np.random.rand(5,100,60).astype(np.float32)
+    fig, ax = plt.subplots(1, 1)
+    tracker = show_stack.IndexTracker(ax, stack, max_size=32)
+
+    assert tracker.step == 4
+    assert tracker.ind == 2
+    assert np.array_equal(tracker.im.get_array(), stack[2,::4,::4])
+    assert tracker.im.get_extent() == [-0.5, 59.5, 99.5, -0.5]
+    assert ax.get_ylabel() == 'projection 2'
+    plt.close(fig)
+
+def test_index_tracker_full_resolution ():
+    '''
+    Test for show_stack.IndexTracker with max_size None or images smaller than max_size.
+    The test asserts that the images are shown at full resolution.
+    '''
+    stack = np.arange(3*20*10, dtype=np.float32).reshape(3,20,10)
+    for max_size in (None, 20):
+        fig, ax = plt.subplots(1, 1)
+        tracker = show_stack.IndexTracker(ax, stack, max_size=max_size)
+        assert tracker.step == 1
+        assert np.array_equal(tracker.im.get_array(), stack[1])
+        plt.close(fig)
+
+def test_index_tracker_cache ():
+    '''
+    Test for the cache of the previews of show_stack.IndexTracker.
+    Scrolling back and forth through the images, the test asserts that each preview is
+    computed just once while it is in the cache, that it is computed again once it is
+    removed from the cache, and that the index wraps around the ends of the stack.
+    '''
+    stack = np.random.rand(4,8,8).astype(np.float32)
+    fig, ax = plt.subplots(1, 1)
+    tracker = CountingTracker(ax, stack, cache_size=2)
+    for key in ('right','left','right','right'):
+        press(tracker, key)
+    assert tracker.loaded == [2,3,0]
+    assert tracker.ind == 0
+    assert ax.get_ylabel() == 'projection 0'
+
+    press(tracker, 'left')          #image 3 is still in the cache
+    press(tracker, 'left')          #image 2 was removed from the cache
+    assert tracker.loaded == [2,3,0,2]
+    assert np.array_equal(tracker.im.get_array(), stack[2])
+    plt.close(fig)
+
+def test_index_tracker_file_list (tmp_path):
+    '''
+    Test for show_stack.IndexTracker with a list of paths of images.
+    The test asserts that the number of images and their shape are read from the files,
+    that just the images shown are read and that they are downsampled.
+    '''
+    np.random.seed(1)
+    images = np.random.rand(3,30,20).astype(np.float32)
+    files = []
+    for i, img in enumerate(images):
+        files.append(str(tmp_path / 'proj_{0}.tiff'.format(i)))
+        tifffile.imwrite(files[-1], img)
+
+    fig, ax = plt.subplots(1, 1)
+    tracker = CountingTracker(ax, files, max_size=10)
+    assert (tracker.slices, tracker.rows, tracker.cols) == (3,30,20)
+    assert tracker.step == 3
+    assert tracker.loaded == [1]
+    assert np.allclose(tracker.im.get_array(), images[1,::3,::3])
+    assert tracker.im.get_extent() == [-0.5, 19.5, 29.5, -0.5]
+
+    press(tracker, 'right')
+    assert tracker.loaded == [1,2]
+    assert np.allclose(tracker.im.get_array(), images[2,::3,::3])
+    plt.close(fig)